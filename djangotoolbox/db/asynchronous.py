@@ -0,0 +1,208 @@
+"""
+Adapters exposing nonrel queries and compilers to asyncio code.
+
+NonrelQuery and the compilers have asynchronous counterparts of their
+methods (afetch, acount, adelete, ainsert, aupdate, aexecute_sql and
+aresults_iter) that return awaitables or asynchronous iterators.
+By default they run the blocking implementations in a thread pool of
+the connection, bounded by the ASYNC_WORKERS option (4 by default), so
+at most that many database calls block threads at a time. Back-ends
+with asynchronous drivers may override them (and set the
+supports_async_fetch feature to get results streamed through afetch).
+
+    async for row in compiler.aresults_iter():
+        ...
+
+Awaitables only start their work when awaited, in the running event
+loop, so the methods may also be called outside of coroutines (e.g. to
+pass their results to loop.run_until_complete).
+
+Requires Python 3.5.2 or later (asynchronous iteration and
+loop.create_future).
+"""
+
+from collections import deque
+from functools import partial
+from threading import Lock
+
+
+_executor_lock = Lock()
+
+
+def get_executor(connection):
+    """
+    Returns the connection's thread pool, creating it on first use.
+    """
+    with _executor_lock:
+        if connection.async_executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            connection.async_executor = ThreadPoolExecutor(
+                connection.async_workers)
+        return connection.async_executor
+
+
+def shutdown_executor(connection):
+    """
+    Shuts the connection's thread pool down, if it has been created,
+    without waiting for calls in progress; a new one is created on
+    next use.
+    """
+    with _executor_lock:
+        executor = connection.async_executor
+        connection.async_executor = None
+    if executor is not None:
+        executor.shutdown(wait=False)
+
+
+def get_running_loop():
+    """
+    Returns the event loop running the current coroutine.
+    """
+    import asyncio
+    try:
+        return asyncio.get_running_loop()
+    except AttributeError:
+        # Before Python 3.7 get_event_loop returns the running loop
+        # in coroutines.
+        return asyncio.get_event_loop()
+
+
+class Deferred(object):
+    """
+    An awaitable calling `start` with the running event loop (and the
+    given arguments) when awaited and awaiting the future it returns.
+    """
+
+    def __init__(self, start, *args):
+        self.start = start
+        self.args = args
+
+    def __await__(self):
+        return self.start(get_running_loop(), *self.args).__await__()
+
+
+def _run_in_executor(loop, connection, function):
+    return loop.run_in_executor(get_executor(connection), function)
+
+
+def run_async(connection, function, *args, **kwargs):
+    """
+    Returns an awaitable for the result of the function, called in the
+    connection's thread pool.
+    """
+    return Deferred(_run_in_executor, connection,
+                    partial(function, *args, **kwargs))
+
+
+def _completed(loop, result):
+    future = loop.create_future()
+    future.set_result(result)
+    return future
+
+
+def completed(result):
+    """
+    Returns an awaitable for the result.
+    """
+    return Deferred(_completed, result)
+
+
+def _failed(loop, exception):
+    future = loop.create_future()
+    future.set_exception(exception)
+    return future
+
+
+def failed(exception):
+    """
+    Returns an awaitable raising the exception.
+    """
+    return Deferred(_failed, exception)
+
+
+def _then(loop, awaitable, function):
+    import asyncio
+    result = loop.create_future()
+
+    def done(source):
+        if result.cancelled():
+            return
+        try:
+            result.set_result(function(source.result()))
+        except Exception as e:
+            result.set_exception(e)
+    asyncio.ensure_future(awaitable, loop=loop).add_done_callback(done)
+    return result
+
+
+def then(awaitable, function):
+    """
+    Returns an awaitable for the result of applying the function to the
+    result of another awaitable.
+    """
+    return Deferred(_then, awaitable, function)
+
+
+class AsyncIterator(object):
+    """
+    Iterates asynchronously over the iterator returned by a blocking
+    function, advancing it in the connection's thread pool, by chunks
+    of items (so switching threads is not needed for every item).
+    """
+
+    def __init__(self, function, connection, chunk_size=100):
+        self.function = function
+        self.connection = connection
+        self.chunk_size = chunk_size
+        self.iterator = None
+        self.buffer = deque()
+        self.exhausted = False
+
+    def __aiter__(self):
+        return self
+
+    def _next_chunk(self):
+        if self.iterator is None:
+            self.iterator = iter(self.function())
+        chunk = []
+        for item in self.iterator:
+            chunk.append(item)
+            if len(chunk) >= self.chunk_size:
+                break
+        return chunk
+
+    def _refill(self, chunk):
+        if len(chunk) < self.chunk_size:
+            self.exhausted = True
+        self.buffer.extend(chunk)
+        return self._pop()
+
+    def _pop(self):
+        if not self.buffer:
+            raise StopAsyncIteration()
+        return self.buffer.popleft()
+
+    def __anext__(self):
+        if self.buffer or self.exhausted:
+            try:
+                return completed(self._pop())
+            except StopAsyncIteration as e:
+                return failed(e)
+        return then(run_async(self.connection, self._next_chunk),
+                    self._refill)
+
+
+class MappedAsyncIterator(object):
+    """
+    Applies a function to items of an asynchronous iterator.
+    """
+
+    def __init__(self, source, function):
+        self.source = source
+        self.function = function
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        return then(self.source.__anext__(), self.function)
@@ -21,10 +21,16 @@ else:
     from django.db.backends.base.introspection import BaseDatabaseIntrospection
     from django.db.backends.base.operations import BaseDatabaseOperations
 
+from django.db.models.signals import class_prepared
 from django.db.utils import DatabaseError
 from django.utils import timezone
 from django.utils.functional import Promise
 
+try:
+    from django.core.signals import setting_changed
+except ImportError:
+    from django.test.signals import setting_changed
+
 if django.VERSION < (1, 5):
     from django.utils.encoding import (smart_unicode as smart_text,
                                        smart_str as smart_bytes)
@@ -39,7 +45,63 @@ if django.VERSION < (1, 5):
 else:
     from django.utils.safestring import SafeBytes, SafeText, EscapeBytes, EscapeText
 
+from .asynchronous import shutdown_executor
 from .creation import NonrelDatabaseCreation
+from .querylog import QueryLog
+from .instrumentation import clock
+from .serializers import (
+    compress, decompress, deserialize, is_compressed, serialize)
+from .utils import QueryPlanCache
+
+
+# Field kinds that _value_from_db deconverts in a non-trivial way.
+DECONVERTED_FIELD_KINDS = ('ListField', 'SetField', 'DictField',
+                           'EmbeddedModelField')
+
+
+# Field kinds whose get_db_prep_save always returns numbers or None.
+COERCED_FIELD_KINDS = ('AutoField', 'BigIntegerField', 'BooleanField',
+                       'FloatField', 'IntegerField', 'NullBooleanField',
+                       'PositiveIntegerField', 'PositiveSmallIntegerField',
+                       'SmallIntegerField')
+
+
+# Containers collections are stored in for the "list", "set" and
+# "dict" db_types.
+COLLECTION_DB_TYPES = {'list': list, 'set': set, 'dict': dict}
+
+# Types of values plain_value has to convert.
+WRAPPED_STRING_TYPES = (Promise, SafeBytes, EscapeBytes, SafeText,
+                        EscapeText)
+
+
+def plain_value(value):
+    """
+    Evaluates lazy objects and turns strings marked as safe or needing
+    escaping into plain strings.
+    """
+    # This code relies on unicode cast in django.utils.functional
+    # just evaluating the wrapped function and doing nothing more.
+    if isinstance(value, Promise):
+        value = smart_text(value)
+
+    # Django wraps strings marked as safe or needed escaping,
+    # convert them to just strings for type-inspecting back-ends.
+    if isinstance(value, (SafeBytes, EscapeBytes)):
+        value = smart_bytes(value)
+    elif isinstance(value, (SafeText, EscapeText)):
+        value = smart_text(value)
+    return value
+
+
+def overrides_method(instance, base, name):
+    """
+    Checks if the class of the instance redefines a method of the base.
+    """
+    method = getattr(type(instance), name)
+    base_method = getattr(base, name)
+    return getattr(method, '__func__', method) is not \
+        getattr(base_method, '__func__', base_method)
 
 
 class NonrelDatabaseFeatures(BaseDatabaseFeatures):
@@ -56,9 +118,89 @@ class NonrelDatabaseFeatures(BaseDatabaseFeatures):
 
     # Features that are commonly not available on nonrel databases.
     supports_joins = False
-    supports_select_related = False
     supports_deleting_related_objects = False
 
+    # Number of fetched entities for which related objects are fetched
+    # together (with one "in" query per relation), emulating
+    # select_related() on Django < 1.8. None to leave it unsupported.
+    select_related_chunk_size = None
+
+    @property
+    def supports_select_related(self):
+        return self.select_related_chunk_size is not None and \
+            django.VERSION < (1, 8)
+
+    # Can the back-end handle alternatives of filters? If not, compilers
+    # run a separate query for each conjunction of filters and merge
+    # their results, up to the given number of such queries. None to
+    # assume back-ends overriding NonrelQuery.add_filters handle them.
+    supports_or_filters = None
+    max_or_branches = 30
+
+    # Should filters be simplified before being passed to add_filter?
+    # See NonrelQuery._optimize_filters. Off by default, as back-ends
+    # may rely on getting all the filters of a query (e.g. to choose an
+    # index).
+    optimize_filters = False
+
+    # Should subqueries (e.g. filter(target__in=Target.objects.all()))
+    # be evaluated and replaced by "in" filters with the values they
+    # return? Each "in" filter can get at most max_in_filter_values
+    # values (None for no limit), filters above the limit get split
+    # into alternatives, that may be fetched using up to
+    # max_query_concurrency threads.
+    evaluate_subqueries = False
+    max_in_filter_values = None
+    max_query_concurrency = 1
+
+    # Maximum number of entities passed to a single insert call, None
+    # to pass all objects at once. If set, entities are converted
+    # lazily and passed to NonrelInsertCompiler.insert_many in batches;
+    # with pipeline_inserts a batch is sent while the next one is
+    # converted.
+    max_insert_batch_size = None
+    pipeline_inserts = False
+
+    # Maximum number of entities deleted at once by QuerySet.delete();
+    # if set, primary keys of entities to delete are fetched and
+    # deleted in batches (see NonrelDeleteCompiler.delete_batches).
+    # None to leave the whole delete to NonrelQuery.delete.
+    max_delete_batch_size = None
+
+    # Aggregate functions (e.g. 'SUM') that NonrelQuery.aggregate can
+    # compute in the database. Others are computed by the compiler in
+    # a single pass over fetched entities.
+    native_aggregates = ()
+
+    # Lookups the back-end can filter by, as a dict mapping field kinds
+    # to tuples of lookup types (lookups for field kinds not listed are
+    # taken from the None key). Other constraints (the residual part of
+    # the constraint tree) are checked in memory, for entities fetched
+    # for the rest of the constraints. None to pass all constraints to
+    # the back-end.
+    pushdown_lookups = None
+
+    # Number of entities from which in-memory filtering and sorting
+    # evaluate whole columns at once, using NumPy (if it's installed),
+    # e.g. 10000. None (the default) to always process entities one by
+    # one.
+    vectorize_threshold = None
+
+    # Number of distinct rows kept in memory while emulating distinct();
+    # past it further rows get de-duplicated using sorted runs spilled
+    # to temporary files. None to never spill.
+    distinct_memory_limit = 100000
+
+    # Does NonrelQuery.afetch use an asynchronous driver? If not, the
+    # asynchronous interface runs whole queries in a thread pool
+    # rather than just fetching in it.
+    supports_async_fetch = False
+
+    # In-place update operators (see the expressions module) that
+    # NonrelUpdateCompiler.update_with_operators can apply; updates
+    # using others are done by rewriting entities one by one.
+    supported_update_operators = ()
+
     # Having to decide whether to use an INSERT or an UPDATE query is
     # specific to SQL-based databases.
     distinguishes_insert_from_update = False
@@ -79,6 +221,28 @@ class NonrelDatabaseFeatures(BaseDatabaseFeatures):
         return False
 
 
+# Bumped whenever cached conversion parameters may become stale: when
+# a model class gets prepared (models may be redefined, e.g. in tests)
+# or settings change.
+conversions_generation = [0]
+
+
+def invalidate_conversions(**kwargs):
+    conversions_generation[0] += 1
+
+
+class_prepared.connect(invalidate_conversions)
+setting_changed.connect(invalidate_conversions)
+
+
+def installed_models():
+    if django.VERSION < (1, 7):
+        from django.db.models import get_models
+        return get_models()
+    from django.apps import apps
+    return apps.get_models()
+
+
 class NonrelDatabaseOperations(BaseDatabaseOperations):
     """
     Override all database conversions normally done by fields (through
@@ -118,6 +282,9 @@ class NonrelDatabaseOperations(BaseDatabaseOperations):
           `RelatedField.get_db_prep_lookup`).
     """
 
+    _conversions_generation = None
+    _overrides = None
+
     def pk_default_value(self):
         """
         Returns None, to be interpreted by back-ends as a request to
@@ -228,10 +395,12 @@ class NonrelDatabaseOperations(BaseDatabaseOperations):
     def check_aggregate_support(self, aggregate):
         """
         Nonrel back-ends are only expected to implement COUNT in
-        general.
+        general, other standard aggregates get computed by compilers
+        while streaming through the results.
         """
-        from django.db.models.sql.aggregates import Count
-        if not isinstance(aggregate, Count):
+        function = getattr(aggregate, 'sql_function',
+                           getattr(aggregate, 'function', None))
+        if function not in ('COUNT', 'SUM', 'AVG', 'MIN', 'MAX'):
             raise NotImplementedError("This database does not support %r "
                                       "aggregates." % type(aggregate))
 
@@ -277,11 +446,110 @@ class NonrelDatabaseOperations(BaseDatabaseOperations):
         """
         return self._value_from_db(value, *self._convert_as(field))
 
+    def get_value_from_db_converter(self, field):
+        """
+        Returns a function that deconverts database values for the
+        field (doing the same as `value_from_db` followed by
+        `convert_values`), or None if values need no deconversion.
+
+        Parameters computed by `_convert_as` are bound in advance, so
+        compilers can prepare this once per field and then apply it to
+        each row. Identity deconversions are only detected for methods
+        not overridden by the back-end.
+        """
+        convert_as = self._convert_as(field)
+        field_kind = convert_as[1]
+
+        if overrides_method(self, NonrelDatabaseOperations,
+                            'value_from_db'):
+            value_from_db = lambda value: self.value_from_db(value, field)
+        elif (field_kind in DECONVERTED_FIELD_KINDS or
+                overrides_method(self, NonrelDatabaseOperations,
+                                 '_value_from_db')):
+            deconvert = self._value_from_db
+            value_from_db = lambda value: deconvert(value, *convert_as)
+        else:
+            value_from_db = None
+
+        if not overrides_method(self, NonrelDatabaseOperations,
+                                'convert_values'):
+            return value_from_db
+
+        convert_values = self.convert_values
+        if value_from_db is None:
+            return lambda value: convert_values(value, field)
+        return lambda value: convert_values(value_from_db(value), field)
+
+    def get_value_for_db_converter(self, field):
+        """
+        Returns a function preparing values of the field for storage
+        (doing the same as `value_for_db`, for values that went through
+        `get_db_prep_save`), or None if values need no conversion.
+
+        As with `get_value_from_db_converter`, shortcuts are only taken
+        for methods not overridden by the back-end.
+        """
+        if overrides_method(self, NonrelDatabaseOperations,
+                            'value_for_db') or \
+                overrides_method(self, NonrelDatabaseOperations,
+                                 '_value_for_db'):
+            return lambda value: self.value_for_db(value, field)
+
+        convert_as = self._convert_as(field)
+        field_kind = convert_as[1]
+        if field_kind in DECONVERTED_FIELD_KINDS:
+            convert = self._value_for_db
+            return lambda value: convert(value, lookup=None, *convert_as)
+        elif field_kind in COERCED_FIELD_KINDS:
+            return None
+        return plain_value
+
     def _convert_as(self, field, lookup=None):
         """
         Computes parameters that should be used for preparing the field
         for the database or deconverting a database value for it.
+
+        Results are cached per field (and kind of lookup) until any
+        model class gets prepared or settings change.
+        """
+        if self._conversions_generation != conversions_generation[0]:
+            self._conversions = {}
+            self._conversions_generation = conversions_generation[0]
+        key = (id(field), lookup in ('month', 'day'))
+        try:
+            cached_field, result = self._conversions[key]
+        except KeyError:
+            pass
+        else:
+            # Keep the field alive, so its id can't get reused.
+            if cached_field is field:
+                return result
+        result = self._compute_convert_as(field, lookup)
+        self._conversions[key] = (field, result)
+        return result
+
+    def warm_conversions(self, models=None):
         """
+        Precomputes conversion parameters for fields of the given (by
+        default all installed) models, to avoid the cost on first
+        queries (e.g. when called at startup).
+        """
+        if models is None:
+            models = installed_models()
+        for model in models:
+            for field in model._meta.local_fields:
+                self._warm_field(field)
+
+    def _warm_field(self, field):
+        self._convert_as(field)
+        field_kind = field.get_internal_type()
+        if field_kind in ('DateField', 'DateTimeField'):
+            self._convert_as(field, 'month')
+        item_field = getattr(field, 'item_field', None)
+        if item_field is not None:
+            self._warm_field(item_field)
+
+    def _compute_convert_as(self, field, lookup=None):
         # We need to compute db_type using the original field to allow
         # GAE to use different storage for primary and foreign keys.
         db_type = self.connection.creation.db_type(field)
@@ -341,26 +609,16 @@ class NonrelDatabaseOperations(BaseDatabaseOperations):
             return None
 
         # Force evaluation of lazy objects (e.g. lazy translation
-        # strings).
+        # strings) and unwrap marked strings.
         # Some back-ends pass values directly to the database driver,
         # which may fail if it relies on type inspection and gets a
         # functional proxy.
-        # This code relies on unicode cast in django.utils.functional
-        # just evaluating the wrapped function and doing nothing more.
         # TODO: This has been partially fixed in vanilla with:
         #       https://code.djangoproject.com/changeset/17698, however
         #       still fails for proxies in lookups; reconsider in 1.4.
         #       Also research cases of database operations not done
         #       through the sql.Query.
-        if isinstance(value, Promise):
-            value = smart_text(value)
-
-        # Django wraps strings marked as safe or needed escaping,
-        # convert them to just strings for type-inspecting back-ends.
-        if isinstance(value, (SafeBytes, EscapeBytes)):
-            value = smart_bytes(value)
-        elif isinstance(value, (SafeText, EscapeText)):
-            value = smart_text(value)
+        value = plain_value(value)
 
         # Convert elements of collection fields.
         if field_kind in ('ListField', 'SetField', 'DictField',):
@@ -435,8 +693,8 @@ class NonrelDatabaseOperations(BaseDatabaseOperations):
         values interleaved will be returned (list of pairs is not good,
         because lists / tuples may need conversion themselves; the list
         may still be nested for dicts containing collections).
-        The "string" and "bytes" db_types use serialization with pickle
-        protocol 0 or 2 respectively.
+        The "string" and "bytes" db_types use serialization (see
+        `_serialize`).
         If an unknown db_type is specified, returns a generator
         yielding converted elements / pairs with converted values.
         """
@@ -451,6 +709,16 @@ class NonrelDatabaseOperations(BaseDatabaseOperations):
             value = self._value_for_db(value, subfield,
                                        subkind, db_subtype, lookup)
 
+        # Copy (or just pass) collections that need no conversion of
+        # items as a whole.
+        elif self._items_pass_through(value, field_kind, subkind, db_type):
+            if db_type == 'bytes' or db_type == 'string':
+                if type(value) is not field._type:
+                    value = field._type(value)
+                return self._serialize(value, field, db_type)
+            container = COLLECTION_DB_TYPES[db_type]
+            return value if type(value) is container else container(value)
+
         # Convert list/set items or dict values.
         else:
             if field_kind == 'DictField':
@@ -482,17 +750,55 @@ class NonrelDatabaseOperations(BaseDatabaseOperations):
                     # assert field_kind != 'ListField'
                     return set(value)
 
-            # Pickled formats may be used for all collection fields,
+            # Serialized formats may be used for all collection fields,
             # the fields "natural" type is serialized (something
             # concrete is needed, pickle can't handle generators :-)
-            if db_type == 'bytes':
-                return pickle.dumps(field._type(value), protocol=2)
-            elif db_type == 'string':
-                return pickle.dumps(field._type(value))
+            if db_type == 'bytes' or db_type == 'string':
+                return self._serialize(field._type(value), field, db_type)
 
         # If nothing matched, pass the generator to the back-end.
         return value
 
+    def _converts_values(self):
+        """
+        Returns a pair of flags telling if the back-end overrides the
+        conversions of single values done for storage and done on
+        values loaded.
+        """
+        if self._overrides is None:
+            self._overrides = (
+                overrides_method(self, NonrelDatabaseOperations,
+                                 '_value_for_db'),
+                overrides_method(self, NonrelDatabaseOperations,
+                                 '_value_from_db'))
+        return self._overrides
+
+    def _items_pass_through(self, value, field_kind, item_kind, db_type):
+        """
+        Checks if a collection can be stored with the given db_type
+        without converting its items one by one: if `_value_for_db`
+        leaves values of the item kind as they are (the default
+        implementation only unwraps lazy and marked strings, that are
+        checked for by types) and the db_type doesn't need the items
+        to be rearranged.
+
+        Back-ends overriding `_value_for_db` may extend this to allow
+        the shortcut for kinds they don't convert.
+        """
+        if field_kind == 'DictField':
+            if db_type not in ('dict', 'bytes', 'string'):
+                return False
+        elif db_type not in ('list', 'set', 'bytes', 'string'):
+            return False
+        if item_kind in DECONVERTED_FIELD_KINDS or \
+                self._converts_values()[0]:
+            return False
+        if item_kind in COERCED_FIELD_KINDS:
+            return True
+        items = value.values() if field_kind == 'DictField' else value
+        return not any(issubclass(type_, WRAPPED_STRING_TYPES)
+                       for type_ in set(map(type, items)))
+
     def _value_from_db_collection(self, value, field, field_kind, db_type):
         """
         Recursively deconverts values for AbstractIterableFields.
@@ -505,9 +811,22 @@ class NonrelDatabaseOperations(BaseDatabaseOperations):
         """
         subfield, subkind, db_subtype = self._convert_as(field.item_field)
 
-        # Unpickle (a dict) if a serialized storage is used.
+        # Deserialize if a serialized storage is used.
         if db_type == 'bytes' or db_type == 'string':
-            value = pickle.loads(value)
+            value = self._deserialize(value)
+
+        # Items needing no deconversion, just copy the collection (the
+        # driver may keep the object it returned).
+        if subkind not in DECONVERTED_FIELD_KINDS and \
+                not self._converts_values()[1]:
+            if field_kind == 'DictField':
+                if db_type == 'list':
+                    return dict(zip(value[::2], value[1::2]))
+                return dict(value)
+            elif field_kind == 'ListField':
+                return list(value)
+            elif field_kind == 'SetField':
+                return set(value)
 
         if field_kind == 'DictField':
 
@@ -541,6 +860,59 @@ class NonrelDatabaseOperations(BaseDatabaseOperations):
             # A new field kind? Maybe it can take a generator.
             return value
 
+    def _serialize(self, value, field, db_type):
+        """
+        Serializes a collection or an embedded instance mapping using
+        the serializer chosen for the field or the connection (see the
+        serializers module).
+
+        By default "bytes" use the "pickle" serializer, while "string"
+        keeps using untagged protocol 0 pickles (that are ASCII).
+
+        Serialized "bytes" of at least COMPRESSION_THRESHOLD (1024 by
+        default) are compressed if the COMPRESSION option names a
+        compressor; compression is reported to the collector as the
+        "compress" and "decompress" phases, with "size" and
+        "compressed_size" counters.
+        """
+        options = self.connection.settings_dict.get('OPTIONS', {})
+        name = getattr(field, 'serializer', None) or \
+            options.get('SERIALIZER')
+        if name is None:
+            if db_type == 'string':
+                return pickle.dumps(value)
+            name = 'pickle'
+        data = serialize(value, name)
+
+        # Compress large values, if requested, keeping them as they are
+        # if that doesn't make them smaller.
+        compressor = options.get('COMPRESSION')
+        if db_type != 'bytes' or compressor is None or \
+                len(data) < options.get('COMPRESSION_THRESHOLD', 1024):
+            return data
+        start = clock()
+        compressed = compress(data, compressor)
+        collector = getattr(self.connection, 'collector', None)
+        if collector is not None:
+            collector.record('compress', clock() - start,
+                             size=len(data), compressed_size=len(compressed))
+        if len(compressed) < len(data):
+            return compressed
+        return data
+
+    def _deserialize(self, data):
+        """
+        Loads a value stored by `_serialize`, timing decompression.
+        """
+        collector = getattr(self.connection, 'collector', None)
+        if collector is None or not is_compressed(data):
+            return deserialize(data)
+        start = clock()
+        decompressed = decompress(data)
+        collector.record('decompress', clock() - start,
+                         size=len(decompressed), compressed_size=len(data))
+        return deserialize(decompressed)
+
     def _value_for_db_model(self, value, field, field_kind, db_type, lookup):
         """
         Converts a field => value mapping received from an
@@ -558,8 +930,8 @@ class NonrelDatabaseOperations(BaseDatabaseOperations):
         interleaved will be returned. Note that just a single level of
         the list is flattened, so it still may be nested -- when the
         embedded instance holds other embedded models or collections).
-        Using "bytes" or "string" pickles the mapping using pickle
-        protocol 0 or 2 respectively.
+        Using "bytes" or "string" serializes the mapping (see
+        `_serialize`).
         If an unknown db_type is used a generator yielding (column,
         value) pairs with values converted will be returned.
 
@@ -583,10 +955,8 @@ class NonrelDatabaseOperations(BaseDatabaseOperations):
             value = dict(value)
         elif db_type == 'list':
             value = list(item for pair in value for item in pair)
-        elif db_type == 'bytes':
-            value = pickle.dumps(dict(value), protocol=2)
-        elif db_type == 'string':
-            value = pickle.dumps(dict(value))
+        elif db_type == 'bytes' or db_type == 'string':
+            value = self._serialize(dict(value), field, db_type)
 
         return value
 
@@ -601,11 +971,11 @@ class NonrelDatabaseOperations(BaseDatabaseOperations):
         mapping.
         """
 
-        # Separate keys from values and create a dict or unpickle one.
+        # Separate keys from values and create a dict or deserialize one.
         if db_type == 'list':
             value = dict(zip(value[::2], value[1::2]))
         elif db_type == 'bytes' or db_type == 'string':
-            value = pickle.loads(value)
+            value = self._deserialize(value)
 
         # Let untyped fields determine the embedded instance's model.
         embedded_model = field.stored_model(value)
@@ -735,6 +1105,35 @@ class NonrelDatabaseWrapper(BaseDatabaseWrapper):
         'iendswith': 'LIKE UPPER(%s)',
     }
 
+    def __init__(self, *args, **kwargs):
+        super(NonrelDatabaseWrapper, self).__init__(*args, **kwargs)
+
+        # Plans of recently executed queries, reused by queries of the
+        # same shape (differing only in lookup arguments); the size may
+        # be set using the QUERY_PLAN_CACHE_SIZE option.
+        options = self.settings_dict.get('OPTIONS', {})
+        self.query_plans = QueryPlanCache(
+            options.get('QUERY_PLAN_CACHE_SIZE', 500))
+
+        # Records of recent queries: all of them when debugging, and a
+        # sample of them (none by default) otherwise.
+        self.query_log = QueryLog(options.get('QUERY_LOG_SIZE', 100),
+                                  options.get('QUERY_LOG_SAMPLE_RATE', 0.0))
+
+        # Receives durations of compilation phases, if set (see the
+        # instrumentation module).
+        self.collector = None
+
+        # Entity encoding and decoding functions generated for lists of
+        # fields (see the codegen module).
+        self.codecs = {}
+        self.codecs_generation = None
+
+        # Thread pool running blocking calls for the asynchronous
+        # interface, created on first use (see the asynchronous module).
+        self.async_workers = options.get('ASYNC_WORKERS', 4)
+        self.async_executor = None
+
     def get_connection_params(self):
         return {}
 
@@ -749,3 +1148,7 @@ class NonrelDatabaseWrapper(BaseDatabaseWrapper):
 
     def _cursor(self):
         return FakeCursor()
+
+    def close(self):
+        shutdown_executor(self)
+        super(NonrelDatabaseWrapper, self).close()
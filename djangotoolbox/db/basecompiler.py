@@ -1,15 +1,30 @@
-import datetime
+import heapq
+import re
+from functools import partial
+from itertools import chain, islice
 
 import django
 from django.conf import settings
-from django.db.models.fields import NOT_PROVIDED
+from django.db.models.base import Model
 from django.db.models.query import QuerySet
+from django.db.models.query_utils import Q
 from django.db.models.sql.compiler import SQLCompiler
 from django.db.models.sql.constants import MULTI, SINGLE
+from django.db.models.sql.query import Query
 from django.db.models.sql.where import AND, OR
-from django.db.utils import DatabaseError, IntegrityError
+from django.db.utils import DatabaseError
 from django.utils.tree import Node
-from django.db import connections
+
+from .asynchronous import (
+    AsyncIterator, MappedAsyncIterator, completed, run_async, then)
+from .base import overrides_method
+from .codegen import get_decoder, get_encoder
+from .expressions import NUMBER_TYPES, UpdateOperator, apply_operator
+from .instrumentation import clock, instrumented, timed_results
+from .querylog import QueryRecord
+from .signals import delete_progress
+from . import vectorized
+from .utils import map_concurrently, unique_rows
 
 try:
     from django.db.models.sql.where import SubqueryConstraint
@@ -42,19 +57,216 @@ else:
         else:
             return query.model._meta.fields
 
+if hasattr(u'', 'casefold'):
+    def casefold(value):
+        return value.casefold()
+else:
+    def casefold(value):
+        return value.lower()
+
+
+_regexes = {}
+
+
+def compile_regex(pattern, ignore_case=False):
+    """
+    Returns a compiled regular expression, caching a limited number of
+    them (a bit more than the re module does).
+    """
+    key = (pattern, ignore_case)
+    try:
+        return _regexes[key]
+    except KeyError:
+        pass
+    if len(_regexes) >= 1000:
+        _regexes.clear()
+    flags = re.UNICODE
+    if ignore_case:
+        flags |= re.IGNORECASE
+    regex = _regexes[key] = re.compile(pattern, flags)
+    return regex
+
+
 EMULATED_OPS = {
     'exact': lambda x, y: y in x if isinstance(x, (list, tuple)) else x == y,
-    'iexact': lambda x, y: x.lower() == y.lower(),
-    'startswith': lambda x, y: x.startswith(y[0]),
-    'istartswith': lambda x, y: x.lower().startswith(y[0].lower()),
+    'iexact': lambda x, y: casefold(x) == casefold(y),
+    'startswith': lambda x, y: x.startswith(y),
+    'istartswith': lambda x, y: casefold(x).startswith(casefold(y)),
+    'endswith': lambda x, y: x.endswith(y),
+    'iendswith': lambda x, y: casefold(x).endswith(casefold(y)),
+    'contains': lambda x, y: y in x,
+    'icontains': lambda x, y: casefold(y) in casefold(x),
+    'regex': lambda x, y: compile_regex(y).search(x) is not None,
+    'iregex': lambda x, y: compile_regex(y, True).search(x) is not None,
     'isnull': lambda x, y: x is None if y else x is not None,
     'in': lambda x, y: x in y,
     'lt': lambda x, y: x < y,
     'lte': lambda x, y: x <= y,
     'gt': lambda x, y: x > y,
     'gte': lambda x, y: x >= y,
+    'range': lambda x, y: y[0] <= x <= y[1],
+    # Year bounds are [Jan 1 of the year, Jan 1 of the next year).
+    'year': lambda x, y: y[0] <= x < y[1],
+    'month': lambda x, y: x.month == y,
+    'day': lambda x, y: x.day == y,
+}
+
+# Variants of case-insensitive operators taking an already folded
+# lookup argument.
+FOLDED_OPS = {
+    'iexact': lambda x, y: casefold(x) == y,
+    'istartswith': lambda x, y: casefold(x).startswith(y),
+    'iendswith': lambda x, y: casefold(x).endswith(y),
+    'icontains': lambda x, y: y in casefold(x),
 }
 
+# Lookups that never match a null value.
+NULL_REJECTING_LOOKUPS = ('startswith', 'contains', 'endswith', 'iexact',
+                          'istartswith', 'icontains', 'iendswith', 'regex',
+                          'iregex', 'range', 'year', 'month', 'day')
+
+# Results of comparisons with null values, that sort before any other
+# value (like with in-memory ordering and Python 2 comparisons).
+NULL_COMPARISONS = {'lt': True, 'lte': True, 'gt': False, 'gte': False}
+
+
+# Streaming implementations of aggregate functions: an initial state,
+# a function adding a (non-null) value to the state and a function
+# computing the aggregate's value from the final state.
+EMULATED_AGGREGATES = {
+    'COUNT': (0, lambda state, value: state + 1, lambda state: state),
+    'SUM': (None, lambda state, value: value if state is None
+            else state + value, lambda state: state),
+    'MIN': (None, lambda state, value: value if state is None or
+            value < state else state, lambda state: state),
+    'MAX': (None, lambda state, value: value if state is None or
+            value > state else state, lambda state: state),
+    'AVG': ((0, 0), lambda state, value: (state[0] + value, state[1] + 1),
+            lambda state: float(state[0]) / state[1] if state[1] else None),
+}
+
+
+def _match_all(entity):
+    return True
+
+
+# Lookups that _optimize_filters merges and field kinds it doesn't
+# touch (as their lookups don't compare whole values).
+MERGED_LOOKUPS = ('exact', 'in', 'isnull', 'lt', 'lte', 'gt', 'gte')
+UNMERGED_FIELD_KINDS = ('AbstractIterableField', 'ListField', 'SetField',
+                        'DictField', 'EmbeddedModelField', 'RawField',
+                        'BlobField')
+
+
+def _same_filter(lhs, rhs):
+    return lhs[0] is rhs[0] and lhs[1:] == rhs[1:]
+
+
+def _unique(values):
+    """
+    Returns a list of the values without repetitions, in order.
+    """
+    seen = set()
+    result = []
+    for value in values:
+        if value not in seen:
+            seen.add(value)
+            result.append(value)
+    return result
+
+
+def _merge_field_filters(filters):
+    """
+    Merges non-negated filters on a single field (see
+    NonrelQuery._optimize_filters) into at most one equality or "in"
+    filter, or an "isnull" filter and range bounds.
+    """
+    field = filters[0][0]
+    exact = []
+    in_values = None
+    isnull = None
+    lower = upper = None
+
+    for _, lookup_type, _, value in filters:
+        if lookup_type == 'exact':
+            if exact and exact[0] != value:
+                raise EmptyResultSet()
+            exact = [value]
+        elif lookup_type == 'in':
+            if in_values is None:
+                in_values = _unique(value)
+            else:
+                value = set(value)
+                in_values = [subvalue for subvalue in in_values
+                             if subvalue in value]
+        elif lookup_type == 'isnull':
+            if isnull is not None and isnull != bool(value):
+                raise EmptyResultSet()
+            isnull = bool(value)
+        elif lookup_type in ('gt', 'gte'):
+            strict = lookup_type == 'gt'
+            if lower is None or value > lower[0] or \
+                    (value == lower[0] and strict):
+                lower = (value, strict)
+        else:
+            strict = lookup_type == 'lt'
+            if upper is None or value < upper[0] or \
+                    (value == upper[0] and strict):
+                upper = (value, strict)
+
+    def in_range(value):
+        if lower is not None and (value < lower[0] or
+                                  (value == lower[0] and lower[1])):
+            return False
+        if upper is not None and (value > upper[0] or
+                                  (value == upper[0] and upper[1])):
+            return False
+        return True
+
+    if exact or in_values is not None:
+        if isnull:
+            raise EmptyResultSet()
+        values = exact or in_values
+        if exact and in_values is not None and exact[0] not in in_values:
+            raise EmptyResultSet()
+        values = [value for value in values if in_range(value)]
+        if not values:
+            raise EmptyResultSet()
+        elif len(values) == 1:
+            return [(field, 'exact', False, values[0])]
+        return [(field, 'in', False, values)]
+
+    result = []
+    if isnull is not None:
+        if isnull and (lower is not None or upper is not None):
+            raise EmptyResultSet()
+        result.append((field, 'isnull', False, isnull))
+    if lower is not None and upper is not None and \
+            (lower[0] > upper[0] or
+             (lower[0] == upper[0] and (lower[1] or upper[1]))):
+        raise EmptyResultSet()
+    if lower is not None:
+        result.append((field, 'gt' if lower[1] else 'gte', False, lower[0]))
+    if upper is not None:
+        result.append((field, 'lt' if upper[1] else 'lte', False, upper[0]))
+    return result
+
+
+class EvaluatedConstraint(object):
+    """
+    A constraint leaf with a lookup argument computed by nonrel rather
+    than by Django's SQL machinery (e.g. values of a subquery).
+    """
+
+    def __init__(self, field, lookup_type, value):
+        self.field = field
+        self.lookup_type = lookup_type
+        self.value = value
+
+    def __repr__(self):
+        return '<EvaluatedConstraint: %s__%s %r>' % (
+            self.field.name, self.lookup_type, self.value)
+
 
 class NonrelQuery(object):
     """
@@ -91,6 +303,12 @@ class NonrelQuery(object):
         self.query = compiler.query  # sql.Query
         self.fields = fields
         self._negated = False
+        self._compiled_filters = None
+        self._ordering_key = None
+
+        # Fields resolved for constraint leaves, keyed by leaf id, shared
+        # with the compiler's query plan.
+        self._leaf_fields = None
 
     def fetch(self, low_mark=0, high_mark=None):
         """
@@ -111,6 +329,40 @@ class NonrelQuery(object):
         """
         raise NotImplementedError
 
+    def afetch(self, low_mark=0, high_mark=None):
+        """
+        Asynchronous counterpart of fetch, returns an asynchronous
+        iterator over entities. Back-ends with asynchronous drivers may
+        override this (and set the supports_async_fetch feature), by
+        default fetch is run in the connection's thread pool.
+        """
+        return AsyncIterator(partial(self.fetch, low_mark, high_mark),
+                             self.connection)
+
+    def acount(self, limit=None):
+        """
+        Returns an awaitable for the result of count.
+        """
+        return run_async(self.connection, self.count, limit)
+
+    def adelete(self):
+        """
+        Returns an awaitable for the completion of delete.
+        """
+        return run_async(self.connection, self.delete)
+
+    def aggregate(self, aggregates):
+        """
+        Computes aggregates of entities matching the query, for
+        back-ends that list the aggregate functions in the
+        native_aggregates feature.
+
+        :param aggregates: A list of (function name, field, distinct)
+                           tuples; the field is None for COUNT(*)
+        :returns: A list of aggregate values
+        """
+        raise NotImplementedError
+
     def order_by(self, ordering):
         """
         Reorders query results or execution order. Called by
@@ -136,6 +388,7 @@ class NonrelQuery(object):
         """
         raise NotImplementedError
 
+    @instrumented('filters')
     def add_filters(self, filters):
         """
         Converts a constraint tree (sql.where.WhereNode) created by
@@ -145,10 +398,25 @@ class NonrelQuery(object):
         This assumes the database doesn't support alternatives of
         constraints, you should override this method if it does.
 
+        If the optimize_filters feature is turned on, filters are
+        simplified (see `_optimize_filters`) before being added.
+
         TODO: Simulate both conjunctions and alternatives in general
               let GAE override conjunctions not to split them into
               multiple queries.
         """
+        collected = []
+        self._collect_filters(filters, collected)
+        if self.connection.features.optimize_filters:
+            collected = self._optimize_filters(collected)
+        for field, lookup_type, negated, value in collected:
+            self.add_filter(field, lookup_type, negated, value)
+
+    def _collect_filters(self, filters, collected):
+        """
+        Decodes leaves of a constraint tree, appending (field,
+        lookup_type, negated, value) tuples to the given list.
+        """
         if filters.negated:
             self._negated = not self._negated
 
@@ -165,18 +433,69 @@ class NonrelQuery(object):
                                 "backend can convert them like this: "
                                 "'not (a OR b) => (not a) AND (not b)'.")
 
-        # Recursively call the method for internal tree nodes, add a
-        # filter for each leaf.
+        # Recursively collect filters from internal tree nodes, decode
+        # each leaf.
         for child in children:
             if isinstance(child, Node):
-                self.add_filters(child)
+                self._collect_filters(child, collected)
                 continue
             field, lookup_type, value = self._decode_child(child)
-            self.add_filter(field, lookup_type, self._negated, value)
+            collected.append((field, lookup_type, self._negated, value))
 
         if filters.negated:
             self._negated = not self._negated
 
+    def _optimize_filters(self, filters):
+        """
+        Simplifies a list of (field, lookup_type, negated, value)
+        filters that all have to be satisfied: drops duplicates and
+        merges "exact", "in", "isnull" and range filters on the same
+        field into a single equality or range, raising EmptyResultSet
+        if the filters contradict each other (so no query needs to be
+        run at all).
+
+        Only non-negated filters on fields with scalar values are
+        merged (e.g. "exact" means "contains" for ListFields).
+        """
+        unique = []
+        for item in filters:
+            if not [other for other in unique if _same_filter(item, other)]:
+                unique.append(item)
+
+        # Group mergeable filters by field, remembering the position of
+        # the first filter of each group.
+        order = []
+        groups = {}
+        for item in unique:
+            field, lookup_type, negated, value = item
+            if negated or lookup_type not in MERGED_LOOKUPS or \
+                    field.get_internal_type() in UNMERGED_FIELD_KINDS or \
+                    value is None or \
+                    (lookup_type == 'in' and None in value):
+                order.append(item)
+            elif field.column in groups:
+                groups[field.column].append(item)
+            else:
+                groups[field.column] = [item]
+                order.append(field.column)
+
+        result = []
+        for entry in order:
+            if isinstance(entry, tuple):
+                result.append(entry)
+                continue
+            items = groups[entry]
+            if len(items) == 1:
+                result.extend(items)
+                continue
+            try:
+                result.extend(_merge_field_filters(items))
+            except TypeError:
+                # Values that can't be compared (or hashed), leave them
+                # as they are.
+                result.extend(items)
+        return result
+
     # ----------------------------------------------
     # Internal API for reuse by subclasses
     # ----------------------------------------------
@@ -186,6 +505,10 @@ class NonrelQuery(object):
         Produces arguments suitable for add_filter from a WHERE tree
         leaf (a tuple).
         """
+        if isinstance(child, EvaluatedConstraint):
+            return child.field, child.lookup_type, \
+                self._normalize_lookup_value(child.lookup_type, child.value,
+                                             child.field, True)
 
         if django.VERSION < (1, 7):
             # TODO: Call get_db_prep_lookup directly, constraint.process
@@ -210,15 +533,38 @@ class NonrelQuery(object):
                 annotation = True
 
             value = rhs_params
+            field = None
+            if self._leaf_fields is not None:
+                field = self._leaf_fields.get(id(child))
+            if field is None:
+                packed = child.lhs.get_group_by_cols()[0]
+
+                if django.VERSION < (1, 8):
+                    alias, column = packed
+                else:
+                    alias = packed.alias
+                    column = packed.target.column
+                field = self._resolve_field(child, alias, column,
+                                            child.lhs.output_field)
 
-            packed = child.lhs.get_group_by_cols()[0]
+        if django.VERSION < (1, 7):
+            field = self._resolve_field(child, alias, column, field)
 
-            if django.VERSION < (1, 8):
-                alias, column = packed
-            else:
-                alias = packed.alias
-                column = packed.target.column
-            field = child.lhs.output_field
+        value = self._normalize_lookup_value(
+            lookup_type, value, field, annotation)
+
+        return field, lookup_type, value
+
+    def _resolve_field(self, child, alias, column, field):
+        """
+        Returns the field a constraint leaf should filter on, checking
+        that the constraint doesn't require a JOIN. Remembers the field
+        in the query plan, if there is one.
+        """
+        if self._leaf_fields is not None:
+            resolved = self._leaf_fields.get(id(child))
+            if resolved is not None:
+                return resolved
 
         opts = self.query.model._meta
         if alias and alias != opts.db_table:
@@ -236,10 +582,9 @@ class NonrelQuery(object):
             field = (f for f in opts.fields if f.column == column).next()
             assert field.rel is not None
 
-        value = self._normalize_lookup_value(
-            lookup_type, value, field, annotation)
-
-        return field, lookup_type, value
+        if self._leaf_fields is not None:
+            self._leaf_fields[id(child)] = field
+        return field
 
     def _normalize_lookup_value(self, lookup_type, value, field, annotation):
         """
@@ -313,64 +658,421 @@ class NonrelQuery(object):
         """
         Checks if an entity returned by the database satisfies
         constraints in a WHERE tree (in-memory filtering).
+
+        The tree is compiled on first use and the predicate is reused
+        as long as the same tree is passed; use `_compile_filters`
+        directly if you're filtering many entities.
+        """
+        if self._compiled_filters is None or \
+                self._compiled_filters[0] is not filters:
+            self._compiled_filters = (filters,
+                                      self._compile_filters(filters))
+        return self._compiled_filters[1](entity)
+
+    def _filter_in_memory(self, entities, filters):
+        """
+        Returns a list of entities satisfying constraints in a WHERE
+        tree.
+
+        Starting from the vectorize_threshold feature number of
+        entities, constraints are evaluated for whole columns at once
+        if NumPy is available (and supports the values and lookups).
+        """
+        entities = list(entities)
+        if self._should_vectorize(entities):
+            try:
+                return vectorized.select(
+                    entities, self._vectorize_filters(filters))
+            except vectorized.Unsupported:
+                pass
+        if self._compiled_filters is None or \
+                self._compiled_filters[0] is not filters:
+            self._compiled_filters = (filters,
+                                      self._compile_filters(filters))
+        predicate = self._compiled_filters[1]
+        return [entity for entity in entities if predicate(entity)]
+
+    def _should_vectorize(self, entities):
+        threshold = self.connection.features.vectorize_threshold
+        return vectorized.numpy is not None and threshold is not None and \
+            len(entities) >= threshold
+
+    def _vectorize_filters(self, filters):
+        """
+        Turns a WHERE tree into a tree of decoded constraints, as taken
+        by `vectorized.select`.
+        """
+        children = []
+        for child in filters.children:
+            if isinstance(child, Node):
+                children.append(self._vectorize_filters(child))
+            else:
+                field, lookup_type, value = self._decode_child(child)
+                children.append(('leaf', field.column, lookup_type, value))
+        return ('node', filters.connector, filters.negated, children)
+
+    def _compile_filters(self, filters):
+        """
+        Turns a WHERE tree into a predicate taking a database entity
+        and returning True if it satisfies the constraints.
+
+        All leaves get decoded (and their lookup arguments passed
+        through `value_for_db`) just once, so the predicate is cheap
+        to call for each entity fetched.
         """
 
         # Filters without rules match everything.
         if not filters.children:
-            return True
-
-        result = filters.connector == AND
+            return _match_all
 
+        predicates = []
         for child in filters.children:
-
-            # Recursively check a subtree,
             if isinstance(child, Node):
-                submatch = self._matches_filters(entity, child)
+                predicates.append(self._compile_filters(child))
+            else:
+                predicates.append(self._compile_leaf(child))
+
+        if len(predicates) == 1:
+            predicate = predicates[0]
+        elif filters.connector == AND:
+            def predicate(entity):
+                for submatch in predicates:
+                    if not submatch(entity):
+                        return False
+                return True
+        else:
+            def predicate(entity):
+                for submatch in predicates:
+                    if submatch(entity):
+                        return True
+                return False
+
+        if filters.negated:
+            return lambda entity: not predicate(entity)
+        return predicate
+
+    def _compile_leaf(self, child):
+        """
+        Produces a predicate emulating a single constraint leaf.
+        """
+        field, lookup_type, lookup_value = self._decode_child(child)
+        return self._make_leaf_predicate(field.column, lookup_type,
+                                         lookup_value)
+
+    def _make_leaf_predicate(self, column, lookup_type, lookup_value):
+        """
+        Binds an operator from EMULATED_OPS with an already prepared
+        lookup argument and decides up front what a missing (None)
+        entity value should result in.
+        """
+        try:
+            op = EMULATED_OPS[lookup_type]
+        except KeyError:
+            raise DatabaseError("Lookup type %r can't be emulated "
+                                "in memory." % lookup_type)
+
+        # Fold or compile the lookup argument once, rather than for
+        # every entity.
+        if lookup_type in FOLDED_OPS:
+            op = FOLDED_OPS[lookup_type]
+            lookup_value = casefold(lookup_value)
+        elif lookup_type in ('regex', 'iregex'):
+            regex = compile_regex(lookup_value, lookup_type == 'iregex')
+            op = lambda x, y: regex.search(x) is not None
+
+        if lookup_type in NULL_COMPARISONS:
+            none_result = NULL_COMPARISONS[lookup_type]
+        elif lookup_type in NULL_REJECTING_LOOKUPS:
+            none_result = False
+        else:
+            def predicate(entity):
+                return op(entity[column], lookup_value)
+            return predicate
+
+        def predicate(entity):
+            entity_value = entity[column]
+            if entity_value is None:
+                return none_result
+            return op(entity_value, lookup_value)
+        return predicate
+
+    def _order_in_memory(self, lhs, rhs):
+        """
+        Compares two entities according to the query ordering, for
+        back-ends still sorting with a cmp function. Prefer
+        `_sort_in_memory`, that computes a key once per entity.
+        """
+        if self._ordering_key is None:
+            self._ordering_key = self._make_ordering_key(
+                self.compiler._get_ordering())
+        lhs = self._ordering_key(lhs)
+        rhs = self._ordering_key(rhs)
+        return (rhs < lhs) - (lhs < rhs)
+
+    def _sort_in_memory(self, entities, ordering=None, low_mark=0,
+                        high_mark=None):
+        """
+        Returns a list with entities sorted according to the given
+        ordering (query ordering by default), limited to the
+        `low_mark:high_mark` slice.
+
+        With an upper bound only the first `high_mark` entities are
+        selected (using a heap), rather than sorting all of them.
+        """
+        if ordering is None:
+            ordering = self.compiler._get_ordering()
+
+        # Natural ordering (or its reverse), nothing to sort by.
+        if not isinstance(ordering, (list, tuple)) or not ordering:
+            entities = list(entities)
+            if ordering is False:
+                entities.reverse()
+        else:
+            if not isinstance(entities, list):
+                entities = list(entities)
+            if self._should_vectorize(entities):
+                try:
+                    order = vectorized.argsort(entities, [
+                        (field.column, ascending)
+                        for field, ascending in ordering])
+                except vectorized.Unsupported:
+                    pass
+                else:
+                    return [entities[index]
+                            for index in order[low_mark:high_mark]]
+            key = self._make_ordering_key(ordering)
+            if high_mark is not None:
+                entities = heapq.nsmallest(high_mark, entities, key=key)
+            else:
+                entities = sorted(entities, key=key)
+        return entities[low_mark:high_mark]
 
-            # Check constraint leaf, emulating a database condition.
+    def _make_ordering_key(self, ordering):
+        """
+        Builds a function computing a composite sort key for an entity.
+
+        Each column contributes a (not null, value) pair, so None is
+        never compared with other values and sorts before anything else
+        in ascending and after anything else in descending order.
+        Descending columns are wrapped to reverse their comparisons.
+        """
+        columns = [(field.column, ascending) for field, ascending in ordering]
+
+        if len(columns) == 1:
+            column, ascending = columns[0]
+            if ascending:
+                def key(entity):
+                    value = entity.get(column)
+                    return (value is not None, value)
             else:
-                field, lookup_type, lookup_value = self._decode_child(child)
-                entity_value = entity[field.column]
-
-                if entity_value is None:
-                    if isinstance(lookup_value, (datetime.datetime, datetime.date,
-                                          datetime.time)):
-                        submatch = lookup_type in ('lt', 'lte')
-                    elif lookup_type in (
-                            'startswith', 'contains', 'endswith', 'iexact',
-                            'istartswith', 'icontains', 'iendswith'):
-                        submatch = False
-                    else:
-                        submatch = EMULATED_OPS[lookup_type](
-                            entity_value, lookup_value)
+                def key(entity):
+                    value = entity.get(column)
+                    return _DescendingKey((value is not None, value))
+            return key
+
+        def key(entity):
+            result = []
+            for column, ascending in columns:
+                value = entity.get(column)
+                if ascending:
+                    result.append((value is not None, value))
                 else:
-                    submatch = EMULATED_OPS[lookup_type](
-                        entity_value, lookup_value)
+                    result.append(_DescendingKey((value is not None, value)))
+            return tuple(result)
+        return key
+
+
+class _DescendingKey(object):
+    """
+    Wraps a sort key, inverting its ordering.
+    """
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __ne__(self, other):
+        return self.key != other.key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __gt__(self, other):
+        return self.key < other.key
+
 
-            if filters.connector == OR and submatch:
-                result = True
+class NonrelMergedQuery(NonrelQuery):
+    """
+    Emulates alternatives of constraints for back-ends that only
+    support conjunctions, by running a query for each conjunction of
+    the constraints tree in disjunctive normal form and merging their
+    results.
+
+    Results of the queries are merged according to the ordering (so
+    each query only needs to fetch up to the upper mark), entities
+    with the same primary key are only returned once and the marks
+    are applied to the merged stream.
+    """
+
+    def __init__(self, compiler, fields, queries):
+        super(NonrelMergedQuery, self).__init__(compiler, fields)
+        self.queries = queries
+        self.ordering = True
+        self.pk_column = self.query.get_meta().pk.column
+
+    def __repr__(self):
+        return '<NonrelMergedQuery: %s>' % \
+            ' OR '.join(repr(query) for query in self.queries)
+
+    def fetch(self, low_mark=0, high_mark=None):
+        concurrency = self.connection.features.max_query_concurrency
+        if concurrency > 1:
+            results = map_concurrently(
+                lambda query: list(query.fetch(0, high_mark)),
+                self.queries, concurrency)
+        else:
+            results = [query.fetch(0, high_mark) for query in self.queries]
+        if isinstance(self.ordering, (list, tuple)) and self.ordering:
+            results = self._merge(results)
+        else:
+            results = chain(*results)
+        return islice(self._unique(results), low_mark, high_mark)
+
+    def count(self, limit=None):
+        results = chain(*[query.fetch(0, limit) for query in self.queries])
+        return sum(1 for _ in islice(self._unique(results), limit))
+
+    def delete(self):
+        for query in self.queries:
+            query.delete()
+
+    def order_by(self, ordering):
+        self.ordering = ordering
+        for query in self.queries:
+            query.order_by(ordering)
+
+    def add_filter(self, field, lookup_type, negated, value):
+        for query in self.queries:
+            query.add_filter(field, lookup_type, negated, value)
+
+    def _merge(self, results):
+        """
+        Merges sorted streams of entities using a heap (k-way merge).
+        """
+        key = self._make_ordering_key(self.ordering)
+        heap = []
+        for index, entities in enumerate(results):
+            entities = iter(entities)
+            for entity in entities:
+                heap.append((key(entity), index, entity, entities))
                 break
-            elif filters.connector == AND and not submatch:
-                result = False
+        heapq.heapify(heap)
+
+        while heap:
+            _, index, entity, entities = heap[0]
+            yield entity
+            for entity in entities:
+                heapq.heapreplace(heap, (key(entity), index, entity, entities))
                 break
+            else:
+                heapq.heappop(heap)
 
-        if filters.negated:
-            return not result
-        return result
+    def _unique(self, entities):
+        """
+        Skips entities with primary keys already seen.
+        """
+        seen = set()
+        for entity in entities:
+            pk = entity[self.pk_column]
+            if pk not in seen:
+                seen.add(pk)
+                yield entity
 
-    def _order_in_memory(self, lhs, rhs):
-        for field, ascending in self.compiler._get_ordering():
-            column = field.column
 
-            # TOOD: cmp is removed in python 3. Rewrite this logic to leverage
-            # the __eq__() special function.
-            a = lhs.get(column)
-            b = rhs.get(column)
+class NonrelResidualQuery(NonrelQuery):
+    """
+    Applies constraints a back-end can't handle (the residual part of
+    the constraint tree) to entities returned by a query built for the
+    other constraints.
+
+    As it's not known up front how many entities will be filtered out,
+    a limited fetch goes through windows of the underlying query
+    results, growing them until enough matching entities are found or
+    the results get exhausted.
+    """
+
+    def __init__(self, compiler, fields, query, residual):
+        super(NonrelResidualQuery, self).__init__(compiler, fields)
+        self.inner = query
+        self.residual = residual
+        self.predicate = self._compile_filters(residual)
+        self._compiled_filters = (residual, self.predicate)
+
+    def __repr__(self):
+        return '<NonrelResidualQuery: %r RESIDUAL %s>' % (self.inner,
+                                                          self.residual)
+
+    def fetch(self, low_mark=0, high_mark=None):
+        if high_mark is None:
+            return islice(self._matching(self.inner.fetch(0, None)),
+                          low_mark, None)
+        return islice(self._fetch_windows(high_mark), low_mark, high_mark)
 
-            result = (a > b) - (a < b)
-            if result != 0:
-                return result if ascending else -result
-        return 0
+    def count(self, limit=None):
+        return sum(1 for _ in self.fetch(0, limit))
+
+    def delete(self):
+        """
+        Deletes matching entities by their primary keys, in batches of
+        the "in" lookup size.
+        """
+        pk = self.query.get_meta().pk
+        decode = self.compiler._get_decoder([pk])
+        self.compiler._delete_by_keys([
+            decode(entity)[0] for entity in self.fetch()])
+
+    def order_by(self, ordering):
+        self.inner.order_by(ordering)
+
+    def _matching(self, entities):
+        threshold = self.connection.features.vectorize_threshold
+        if vectorized.numpy is not None and threshold is not None:
+            entities = iter(entities)
+            while True:
+                chunk = list(islice(entities, threshold))
+                if not chunk:
+                    return
+                for entity in self._filter_in_memory(chunk, self.residual):
+                    yield entity
+
+        predicate = self.predicate
+        for entity in entities:
+            if predicate(entity):
+                yield entity
+
+    def _fetch_windows(self, high_mark):
+        """
+        Yields up to `high_mark` matching entities, fetching windows of
+        underlying results twice as large each time (starting with the
+        number of entities still needed).
+        """
+        start = 0
+        size = max(high_mark, 1)
+        found = 0
+        while found < high_mark:
+            window = list(self.inner.fetch(start, start + size))
+            for entity in self._filter_in_memory(window, self.residual):
+                found += 1
+                yield entity
+                if found >= high_mark:
+                    return
+            if len(window) < size:
+                return
+            start += size
+            size *= 2
 
 
 class NonrelCompiler(SQLCompiler):
@@ -389,6 +1091,8 @@ class NonrelCompiler(SQLCompiler):
         """
         super(NonrelCompiler, self).__init__(query, connection, using)
         self.ops = self.connection.ops
+        self._leaf_fields = None
+        self._query_record = None
 
     # ----------------------------------------------
     # Public API
@@ -400,57 +1104,113 @@ class NonrelCompiler(SQLCompiler):
         to this compiler. Called by QuerySet methods.
         """
 
+        fields = self.get_fields()
+        collector = getattr(self.connection, 'collector', None)
+        distinct = self.query.distinct
+        low_mark, high_mark = self.query.low_mark, self.query.high_mark
+        record = None
+        start = clock()
         if results is None:
-            fields = self.get_fields()
             try:
-                results = self.build_query(fields).fetch(
-                    self.query.low_mark, self.query.high_mark)
+                query = self.build_query(fields)
+                record = self._query_record
+                start = clock()
+                # Limits can only be applied to de-duplicated rows.
+                if distinct:
+                    results = query.fetch(0, None)
+                else:
+                    results = query.fetch(low_mark, high_mark)
             except EmptyResultSet:
                 results = []
 
-        for entity in results:
-            yield self._make_result(entity, fields)
+        decode = self._get_decoder(fields)
+        klass_info = self._get_klass_info()
+        if record is None and collector is None and not distinct and \
+                klass_info is None:
+            for entity in results:
+                yield decode(entity)
+            return
+
+        if record is None and collector is None:
+            rows = (decode(entity) for entity in results)
+        else:
+            def finish(fetch_time, rows, decode_time):
+                if record is not None:
+                    record.finish(fetch_time, rows, decode_time)
+                if collector is not None:
+                    collector.record('fetch', fetch_time, rows)
+                    collector.record('decode', decode_time, rows)
+
+            rows = timed_results(results, decode, finish, clock() - start)
+
+        if distinct:
+            rows = islice(unique_rows(
+                    rows, self.connection.features.distinct_memory_limit),
+                low_mark, high_mark)
+        if klass_info is not None:
+            rows = self._select_related(rows, fields, klass_info)
+        for row in rows:
+            yield row
+
+    def aresults_iter(self):
+        """
+        Returns an asynchronous iterator over the results of the query.
+
+        If the back-end fetches asynchronously, entities are streamed
+        through NonrelQuery.afetch and decoded as they arrive; otherwise
+        (or if the query needs post-processing of the whole results)
+        results_iter is run in the connection's thread pool.
+        """
+        if not self.connection.features.supports_async_fetch or \
+                self.query.distinct or self._get_klass_info() is not None:
+            return AsyncIterator(self.results_iter, self.connection)
+
+        fields = self.get_fields()
+        decode = self._get_decoder(fields)
+        try:
+            query = self.build_query(fields)
+        except EmptyResultSet:
+            return AsyncIterator(list, self.connection)
+        return MappedAsyncIterator(
+            query.afetch(self.query.low_mark, self.query.high_mark), decode)
+
+    def aexecute_sql(self, *args, **kwargs):
+        """
+        Returns an awaitable for the result of execute_sql.
+        """
+        return run_async(self.connection, self.execute_sql, *args, **kwargs)
 
     def has_results(self):
         return self.get_count(check_exists=True)
 
     def execute_sql(self, result_type=MULTI):
         """
-        Handles SQL-like aggregate queries. This class only emulates COUNT
-        by using abstract NonrelQuery.count method.
+        Handles SQL-like aggregate queries. Counting all objects uses
+        the abstract NonrelQuery.count method, other aggregates are
+        either computed by NonrelQuery.aggregate (if the back-end
+        declares native support for them) or emulated.
         """
         self.pre_sql_setup()
 
         aggregates = self.query.aggregate_select.values()
+        if not aggregates:
+            return
 
-        # Simulate a count().
-        if aggregates:
-            assert len(aggregates) == 1
-            aggregate = aggregates[0]
-            if django.VERSION < (1, 8):
-                if aggregate.sql_function != 'COUNT':
-                    raise NotImplementedError("The database backend only supports count() queries.")
-            else:
-                if aggregate.function != 'COUNT':
-                    raise NotImplementedError("The database backend only supports count() queries.")
-
-            opts = self.query.get_meta()
+        specs = [self._get_aggregate_spec(aggregate)
+                 for aggregate in aggregates]
+        pk = self.query.get_meta().pk
 
-            if django.VERSION < (1, 8):
-                if aggregate.col != '*' and aggregate.col != (opts.db_table, opts.pk.column):
-                    raise DatabaseError("This database backend only supports "
-                                        "count() queries on the primary key.")
-            else:
-                # Fair warning: the latter part of this or statement hasn't been tested
-                if aggregate.input_field.value != '*' and aggregate.input_field != (opts.db_table, opts.pk.column):
-                    raise DatabaseError("This database backend only supports "
-                                        "count() queries on the primary key.")
+        # Simulate a count().
+        if len(specs) == 1 and specs[0][0] == 'COUNT' and \
+                specs[0][1] in (None, pk):
+            result = [self.get_count()]
+        else:
+            result = self._aggregate(specs)
 
-            count = self.get_count()
-            if result_type is SINGLE:
-                return [count]
-            elif result_type is MULTI:
-                return [[count]]
+        if result_type is SINGLE:
+            return result
+        elif result_type is MULTI:
+            return [result]
 
     # ----------------------------------------------
     # Additional NonrelCompiler API
@@ -464,36 +1224,137 @@ class NonrelCompiler(SQLCompiler):
         names as keys. Decodes values using `value_from_db` as well as
         the standard `convert_values`.
         """
-        result = []
-        for field in fields:
-            value = entity.get(field.column, NOT_PROVIDED)
-            if value is NOT_PROVIDED:
-                value = field.get_default()
-            else:
-                value = self.ops.value_from_db(value, field)
-                # This is the default behavior of ``query.convert_values``
-                # until django 1.8, where multiple converters are a thing.
-                value = self.connection.ops.convert_values(value, field)
-            if value is None and not field.null:
-                raise IntegrityError("Non-nullable field %s can't be None!" %
-                                     field.name)
-            result.append(value)
-        return result
+        return get_decoder(self.connection, fields)(entity)
+
+    def _get_decoder(self, fields):
+        """
+        Returns a function decoding entities fetched for the fields:
+        `_make_result` if the back-end overrides it, a function
+        generated for the fields otherwise (see the codegen module).
+        """
+        if overrides_method(self, NonrelCompiler, '_make_result'):
+            return lambda entity: self._make_result(entity, fields)
+        return get_decoder(self.connection, fields)
+
+    def _get_aggregate_spec(self, aggregate):
+        """
+        Returns a (function name, field, distinct) tuple describing an
+        aggregate; the field is None for aggregates over all rows.
+        """
+        if django.VERSION < (1, 8):
+            function = aggregate.sql_function
+            column = aggregate.col
+            if column == '*':
+                return function, None, False
+            if not isinstance(column, (list, tuple)):
+                raise DatabaseError("Aggregates over other aggregates are "
+                                    "not supported by the backend.")
+            alias, column = column
+        else:
+            function = aggregate.function
+            source = aggregate.get_source_expressions()[0]
+            if getattr(source, 'value', None) == '*':
+                return function, None, False
+            if not hasattr(source, 'target'):
+                raise DatabaseError("Aggregates over expressions are not "
+                                    "supported by the backend.")
+            alias, column = source.alias, source.target.column
+        distinct = bool(aggregate.extra.get('distinct'))
 
+        opts = self.query.get_meta()
+        if alias != opts.db_table:
+            raise DatabaseError("Aggregates can't span tables on "
+                                "non-relational backends.")
+        for field in opts.fields:
+            if field.column == column:
+                return function, field, distinct
+        raise DatabaseError("Can't aggregate over the %s column." % column)
+
+    def _aggregate(self, specs):
+        """
+        Computes values of aggregates described by `_get_aggregate_spec`
+        specs. Unless the back-end can compute all of them, makes a
+        single pass over entities fetched for the aggregated fields.
+
+        Apart from distinct aggregates (that need to keep the values
+        seen) this uses constant memory.
+        """
+        fields = []
+        for function, field, distinct in specs:
+            if field is not None and field not in fields:
+                fields.append(field)
+        pk = self.query.get_meta().pk
+        try:
+            query = self.build_query(fields or [pk])
+        except EmptyResultSet:
+            return [EMULATED_AGGREGATES[function][2](
+                        EMULATED_AGGREGATES[function][0])
+                    for function, field, distinct in specs]
+
+        native = self.connection.features.native_aggregates
+        if isinstance(query, self.query_class) and \
+                all(spec[0] in native for spec in specs):
+            return query.aggregate(specs)
+
+        aggregates = []
+        for function, field, distinct in specs:
+            initial, step, result = EMULATED_AGGREGATES[function]
+            position = None if field is None else fields.index(field)
+            aggregates.append([initial, step, position,
+                               set() if distinct else None])
+
+        decode = self._get_decoder(fields)
+        rows = 0
+        start = clock()
+        for entity in query.fetch(self.query.low_mark, self.query.high_mark):
+            values = decode(entity)
+            rows += 1
+            for aggregate in aggregates:
+                state, step, position, seen = aggregate
+                if position is None:
+                    aggregate[0] = step(state, None)
+                    continue
+                value = values[position]
+                if value is None:
+                    continue
+                if seen is not None:
+                    if value in seen:
+                        continue
+                    seen.add(value)
+                aggregate[0] = step(state, value)
+        self._finish_fetch(clock() - start, rows)
+
+        return [EMULATED_AGGREGATES[function][2](aggregate[0])
+                for (function, field, distinct), aggregate
+                in zip(specs, aggregates)]
+
+    def _finish_fetch(self, duration, rows, **extra):
+        """
+        Reports a completed fetch to the query log and the collector.
+        """
+        if self._query_record is not None:
+            self._query_record.finish(duration, rows)
+        collector = getattr(self.connection, 'collector', None)
+        if collector is not None:
+            collector.record('fetch', duration, rows, **extra)
+
+    @instrumented('check')
     def check_query(self):
         """
         Checks if the current query is supported by the database.
 
         In general, we expect queries requiring JOINs (many-to-many
         relations, abstract model bases, or model spanning filtering),
-        using DISTINCT (through `QuerySet.distinct()`, which is not
-        required in most situations) or using the SQL-specific
-        `QuerySet.extra()` to not work with nonrel back-ends.
+        using DISTINCT ON (through `QuerySet.distinct(*fields)`) or
+        using the SQL-specific `QuerySet.extra()` to not work with
+        nonrel back-ends. Plain `QuerySet.distinct()` is emulated by
+        `results_iter`.
         """
         if hasattr(self.query, 'is_empty') and self.query.is_empty():
             raise EmptyResultSet()
         if (len([a for a in self.query.alias_map if self.query.alias_refcount[a]]) > 1
-                or self.query.distinct or self.query.extra or self.query.having):
+                or getattr(self.query, 'distinct_fields', None)
+                or self.query.extra or self.query.having):
             raise DatabaseError("This query is not supported by the database.")
 
     def get_count(self, check_exists=False):
@@ -506,32 +1367,601 @@ class NonrelCompiler(SQLCompiler):
             high_mark = 1
         else:
             high_mark = self.query.high_mark
+        if self.query.distinct:
+            return sum(1 for _ in islice(self.results_iter(), high_mark))
         try:
-            return self.build_query().count(high_mark)
+            query = self.build_query()
         except EmptyResultSet:
             return 0
-
+        if self._query_record is None and \
+                getattr(self.connection, 'collector', None) is None:
+            return query.count(high_mark)
+        start = clock()
+        count = query.count(high_mark)
+        self._finish_fetch(clock() - start, count, count=True)
+        return count
+
+    @instrumented('build')
     def build_query(self, fields=None):
         """
         Checks if the underlying SQL query is supported and prepares
         a NonrelQuery to be executed on the database.
         """
-        self.check_query()
-        if fields is None:
-            fields = self.get_fields()
-        query = self.query_class(self, fields)
-        query.add_filters(self.query.where)
-        query.order_by(self._get_ordering())
+        plans = getattr(self.connection, 'query_plans', None)
+        plan_key = leaves = plan = None
+        if plans is not None and plans.size > 0:
+            plan_key, leaves = self._get_plan_key(fields)
+            if plan_key is not None:
+                plan = plans.get(plan_key)
+
+        if plan is None:
+            self.check_query()
+            if fields is None:
+                fields = self.get_fields()
+            ordering = self._get_ordering()
+            self._leaf_fields = {}
+        else:
+            fields, ordering, leaf_fields = plan
+            self._leaf_fields = dict(
+                (id(leaf), field) for leaf, field in zip(leaves, leaf_fields)
+                if field is not None)
+
+        where = self.query.where
+        if self.connection.features.evaluate_subqueries:
+            where = self._evaluate_subqueries(where)
+        query_fields = fields
+        residual = None
+        if self.connection.features.pushdown_lookups is not None:
+            where, residual = self._split_residual(where)
+            if where is None:
+                where = self.query.where_class()
+            if residual is not None:
+                query_fields = self._get_residual_fields(fields, residual)
+        if not self._supports_or_filters() and \
+                self._has_alternatives(where):
+            query = self._build_merged_query(query_fields, where)
+        else:
+            query = self._new_query(query_fields)
+            query.add_filters(where)
+        query.order_by(ordering)
+        if residual is not None:
+            query = NonrelResidualQuery(self, query_fields, query, residual)
 
-        # This at least satisfies the most basic unit tests.
+        if plan is None and plan_key is not None:
+            plans.put(plan_key, (fields, ordering, [
+                self._leaf_fields.get(id(leaf)) for leaf in leaves]))
+
+        self._log_query(query, ordering)
+        return query
+
+    def _log_query(self, query, ordering):
+        """
+        Records the query in the connection's query log (if it gets
+        sampled) and in connection.queries when debugging. The record
+        is kept as self._query_record, to be completed with timings.
+        """
+        connection = self.connection
         if django.VERSION < (1, 8):
-            if connections[self.using].use_debug_cursor or (connections[self.using].use_debug_cursor is None and settings.DEBUG):
-                self.connection.queries.append({'sql': repr(query)})
+            force_debug = connection.use_debug_cursor
         else:
-            if connections[self.using].force_debug_cursor or (connections[self.using].force_debug_cursor is None and settings.DEBUG):
-                self.connection.queries.append({'sql': repr(query)})
+            force_debug = connection.force_debug_cursor
+        debug = force_debug or (force_debug is None and settings.DEBUG)
+        log = getattr(connection, 'query_log', None)
+
+        if not debug and (log is None or not log.sample()):
+            self._query_record = None
+            return
+        record = QueryRecord(repr(query), self.query.model._meta.object_name,
+                             u'%s' % (self.query.where,), ordering,
+                             self.query.low_mark, self.query.high_mark)
+        if log is not None:
+            log.append(record)
+        # This at least satisfies the most basic unit tests.
+        if debug:
+            if hasattr(connection, 'queries_log'):
+                connection.queries_log.append(record)
+            else:
+                connection.queries.append(record)
+        self._query_record = record
+
+    def _new_query(self, fields):
+        """
+        Creates a NonrelQuery sharing the current plan's leaf fields.
+        """
+        query = self.query_class(self, fields)
+        query._leaf_fields = self._leaf_fields
         return query
 
+    def _get_plan_key(self, fields=None):
+        """
+        Returns a key identifying the shape of the current query --
+        everything but the lookup arguments -- and a list of the
+        constraint leaves in a stable order; or (None, None) if the
+        query can't use a cached plan.
+        """
+        query = self.query
+        leaves = []
+        where_shape = self._get_where_shape(query.where, leaves)
+        if where_shape is None:
+            return None, None
+        if fields is not None:
+            fields = tuple(id(field) for field in fields)
+        deferred, defer = query.deferred_loading
+        key = (query.model, where_shape, fields,
+               tuple(id(field) for field in get_selected_fields(query)),
+               frozenset(deferred), defer,
+               tuple(query.order_by), query.default_ordering,
+               query.standard_ordering,
+               query.low_mark != 0, query.high_mark is not None,
+               tuple(a for a in query.alias_map if query.alias_refcount[a]),
+               bool(query.distinct),
+               tuple(getattr(query, 'distinct_fields', ())),
+               bool(query.extra), bool(query.having))
+        return key, leaves
+
+    def _get_where_shape(self, where, leaves):
+        """
+        Returns a hashable description of a constraint tree that ignores
+        lookup arguments, collecting its leaves. Returns None for trees
+        with constraints that can't be described (e.g. ones comparing
+        with subqueries).
+        """
+        shapes = []
+        for child in where.children:
+            if isinstance(child, Node):
+                shape = self._get_where_shape(child, leaves)
+            elif django.VERSION < (1, 7):
+                if not isinstance(child, tuple) or \
+                        self._is_subquery(child[3]) or \
+                        not hasattr(child[0], 'col'):
+                    return None
+                constraint, lookup_type = child[:2]
+                shape = (constraint.alias, constraint.col,
+                         id(constraint.field), lookup_type)
+                leaves.append(child)
+            else:
+                if not hasattr(child, 'lookup_name') or \
+                        self._is_subquery(child.rhs) or \
+                        hasattr(child.rhs, 'as_sql'):
+                    return None
+                columns = child.lhs.get_group_by_cols()
+                if len(columns) != 1:
+                    return None
+                column = columns[0]
+                if django.VERSION >= (1, 8):
+                    column = (column.alias, column.target.column)
+                shape = (child.__class__, column,
+                         id(child.lhs.output_field))
+                leaves.append(child)
+            if shape is None:
+                return None
+            shapes.append(shape)
+        return (where.__class__, where.connector, where.negated,
+                tuple(shapes))
+
+    def _split_residual(self, where):
+        """
+        Splits a constraint tree into a part that can be passed to the
+        back-end (according to the pushdown_lookups feature) and a part
+        that has to be checked in memory. Either may be None.
+
+        Only conjunctions get split, alternatives or negations with any
+        constraint that can't be pushed down are left whole.
+        """
+        if self._can_push_down(where):
+            return where, None
+        if where.connector != AND or where.negated:
+            return None, where
+
+        pushed = []
+        residual = []
+        for child in where.children:
+            if isinstance(child, Node):
+                child_pushed, child_residual = self._split_residual(child)
+                if child_pushed is not None:
+                    pushed.append(child_pushed)
+                if child_residual is not None:
+                    residual.append(child_residual)
+            elif self._can_push_down(child):
+                pushed.append(child)
+            else:
+                residual.append(child)
+
+        return (self.query.where_class(pushed, AND) if pushed else None,
+                self.query.where_class(residual, AND) if residual else None)
+
+    def _can_push_down(self, child):
+        """
+        Checks if the back-end can handle all constraints of a tree.
+        """
+        if isinstance(child, Node):
+            for grandchild in child.children:
+                if not self._can_push_down(grandchild):
+                    return False
+            return True
+
+        lookup = self._get_leaf_lookup(child)
+        if lookup is None:
+            return True
+        field, lookup_type = lookup
+        pushdown_lookups = self.connection.features.pushdown_lookups
+        return lookup_type in pushdown_lookups.get(
+            field.get_internal_type(), pushdown_lookups.get(None, ()))
+
+    def _get_leaf_lookup(self, child):
+        """
+        Returns the (field, lookup type) a constraint leaf filters by,
+        or None for leaves of other kinds.
+        """
+        if isinstance(child, EvaluatedConstraint):
+            return child.field, child.lookup_type
+        if django.VERSION < (1, 7):
+            if not isinstance(child, tuple) or not hasattr(child[0], 'col'):
+                return None
+            field, lookup_type, column = child[0].field, child[1], child[0].col
+        else:
+            if not hasattr(child, 'lookup_name'):
+                return None
+            field, lookup_type = child.lhs.output_field, child.lookup_name
+            column = child.lhs.get_group_by_cols()[0]
+            if django.VERSION < (1, 8):
+                column = column[1]
+            else:
+                column = column.target.column
+        if field.column != column:
+            for other in self.query.get_meta().fields:
+                if other.column == column:
+                    field = other
+                    break
+        return field, lookup_type
+
+    def _get_residual_fields(self, fields, residual):
+        """
+        Returns the fields extended with fields the residual constraints
+        need (and the primary key, used for deleting).
+        """
+        fields = list(fields)
+        pk = self.query.get_meta().pk
+        if pk not in fields:
+            fields.append(pk)
+
+        def add_fields(where):
+            for child in where.children:
+                if isinstance(child, Node):
+                    add_fields(child)
+                    continue
+                lookup = self._get_leaf_lookup(child)
+                if lookup is not None and lookup[0] not in fields:
+                    fields.append(lookup[0])
+        add_fields(residual)
+        return fields
+
+    def _supports_or_filters(self):
+        """
+        Checks if the query class can handle alternatives of filters,
+        according to the supports_or_filters feature or, if it's None,
+        to whether it overrides NonrelQuery.add_filters.
+        """
+        supported = self.connection.features.supports_or_filters
+        if supported is None:
+            add_filters = self.query_class.add_filters
+            return getattr(add_filters, '__func__', add_filters) is not \
+                getattr(NonrelQuery.add_filters, '__func__',
+                        NonrelQuery.add_filters)
+        return supported
+
+    def _has_alternatives(self, where, negated=False):
+        """
+        Checks if a constraint tree contains any alternatives (possibly
+        resulting from a negation of a conjunction).
+        """
+        negated = negated != where.negated
+        if (where.connector == AND) == negated and len(where.children) > 1:
+            return True
+        for child in where.children:
+            if isinstance(child, Node) and \
+                    self._has_alternatives(child, negated):
+                return True
+        return False
+
+    def _build_merged_query(self, fields, where):
+        """
+        Builds a query for each conjunction of the constraint tree
+        converted to disjunctive normal form. Conjunctions found to
+        match nothing (raising EmptyResultSet) are skipped.
+        """
+        pk = self.query.get_meta().pk
+        if pk not in fields:
+            fields = list(fields) + [pk]
+
+        query = self._new_query(fields)
+        conjunctions = self._where_to_dnf(where, query)
+
+        queries = []
+        for conjunction in conjunctions:
+            if query is None:
+                query = self._new_query(fields)
+            children = []
+            for child, negated in conjunction:
+                if negated:
+                    child = self.query.where_class([child], AND, True)
+                children.append(child)
+            try:
+                query.add_filters(self.query.where_class(children, AND))
+            except EmptyResultSet:
+                query = None
+                continue
+            queries.append(query)
+            query = None
+
+        if not queries:
+            raise EmptyResultSet()
+        elif len(queries) == 1:
+            return queries[0]
+        return NonrelMergedQuery(self, fields, queries)
+
+    def _where_to_dnf(self, where, query, negated=False):
+        """
+        Converts a constraint tree to disjunctive normal form: returns
+        a list of conjunctions, each being a list of (leaf, negated)
+        tuples. Negations get pushed down to the leaves.
+        """
+        negated = negated != where.negated
+        conjunction = (where.connector == AND) != negated
+        children = query._get_children(where.children)
+        if not children:
+            return [[]]
+
+        result = [[]] if conjunction else []
+        for child in children:
+            if isinstance(child, Node):
+                child_dnf = self._where_to_dnf(child, query, negated)
+            else:
+                child_dnf = [[(child, negated)]]
+
+            if not conjunction:
+                result.extend(child_dnf)
+                continue
+
+            # Only distributing conjunctions over alternatives may
+            # cause an exponential growth of the number of queries.
+            result = [left + right for left in result for right in child_dnf]
+            if len(result) > self.connection.features.max_or_branches:
+                raise DatabaseError("Too many alternatives of filters to "
+                                    "emulate (over %d)." %
+                                    self.connection.features.max_or_branches)
+        return result
+
+    def _evaluate_subqueries(self, where):
+        """
+        Returns a copy of the constraint tree with constraints comparing
+        values with subqueries replaced by "in" constraints with values
+        the subqueries return; or the tree itself, if it doesn't use
+        any subqueries.
+
+        Lists of values longer than the max_in_filter_values feature
+        get split into chunks and become alternatives of constraints.
+        """
+        children = []
+        changed = False
+        for child in where.children:
+            if isinstance(child, Node):
+                evaluated = self._evaluate_subqueries(child)
+            else:
+                evaluated = self._evaluate_subquery_leaf(child)
+            changed = changed or evaluated is not child
+            children.append(evaluated)
+
+        if not changed:
+            return where
+        return where.__class__(children, where.connector, where.negated)
+
+    def _evaluate_subquery_leaf(self, child):
+        """
+        Replaces a constraint leaf using a subquery with one or more
+        "in" constraints. Other leaves are returned unchanged.
+        """
+        if SubqueryConstraint is not None and \
+                isinstance(child, SubqueryConstraint):
+            if len(child.columns) != 1:
+                raise DatabaseError("Multi-column subqueries are not "
+                                    "supported.")
+            column = child.columns[0]
+            field = [f for f in self.query.get_meta().fields
+                     if f.column == column][0]
+            query = child.query_object
+            if hasattr(query, 'values') and not hasattr(query, 'field_names'):
+                query = query.values(*child.targets)
+            leaves = [EvaluatedConstraint(field, 'in', chunk)
+                      for chunk in self._in_chunks(self._run_subquery(query))]
+        elif isinstance(child, tuple):
+            constraint, lookup_type, annotation, value = child
+            if not self._is_subquery(value):
+                return child
+            leaves = [(constraint, 'in', annotation, chunk)
+                      for chunk in self._in_chunks(self._run_subquery(value))]
+        elif self._is_subquery(getattr(child, 'rhs', None)):
+            lookup_class = child.lhs.output_field.get_lookup('in')
+            leaves = [lookup_class(child.lhs, chunk)
+                      for chunk in self._in_chunks(self._run_subquery(child.rhs))]
+        else:
+            return child
+
+        if len(leaves) == 1:
+            return leaves[0]
+        return self.query.where_class(leaves, OR)
+
+    def _is_subquery(self, value):
+        return isinstance(value, QuerySet) or hasattr(value, 'get_compiler')
+
+    def _run_subquery(self, query):
+        """
+        Executes a subquery (a QuerySet or a sql.Query) using the same
+        connection, returning a list of values of the column it selects
+        (or of primary keys if it selects a whole model).
+        """
+        if isinstance(query, QuerySet):
+            if query.db != self.using:
+                raise DatabaseError("Subqueries have to use the same "
+                                    "database as the outer query.")
+            query = query.query
+        compiler = query.get_compiler(self.using)
+        if not isinstance(compiler, NonrelCompiler):
+            raise DatabaseError("Subqueries are not supported.")
+
+        fields = compiler.get_fields()
+        if len(fields) == 1:
+            index = 0
+        else:
+            index = list(fields).index(query.get_meta().pk)
+        return [row[index] for row in compiler.results_iter()]
+
+    def _delete_by_keys(self, keys):
+        """
+        Deletes entities with the given primary keys, passing them to
+        the back-end directly, in batches of the "in" lookup size.
+        """
+        pk = self.query.get_meta().pk
+        for values in self._in_chunks(keys):
+            query = self.query_class(self, [pk])
+            query.add_filter(pk, 'in', False,
+                             self.ops.value_for_db(values, pk, 'in'))
+            query.delete()
+
+    def _in_chunks(self, values):
+        """
+        Splits a list of "in" lookup values according to the
+        max_in_filter_values feature.
+        """
+        size = self.connection.features.max_in_filter_values
+        if size is None or len(values) <= size:
+            return [values]
+        return [values[start:start + size]
+                for start in range(0, len(values), size)]
+
+    def _get_klass_info(self):
+        """
+        Returns the description of objects QuerySet.iterator expects
+        to find in result rows if select_related() is emulated for the
+        current query, None otherwise.
+        """
+        if not self.query.select_related or \
+                not self.connection.features.supports_select_related:
+            return None
+        from django.db.models.query import get_klass_info
+        requested = self.query.select_related
+        if not isinstance(requested, dict):
+            requested = None
+        return get_klass_info(
+            self.query.model, max_depth=self.query.max_depth,
+            requested=requested,
+            only_load=self.query.get_loaded_field_names())
+
+    def _select_related(self, rows, fields, klass_info):
+        """
+        Extends rows of the queried model with values of related
+        objects, as if they were fetched using JOINs. Related objects
+        are fetched with one "in" query per relation for each chunk of
+        select_related_chunk_size rows.
+        """
+        chunk_size = self.connection.features.select_related_chunk_size
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                return
+            for row, tail in zip(chunk, self._related_tails(
+                    chunk, fields, klass_info)):
+                row.extend(tail)
+                yield row
+
+    def _related_tails(self, rows, fields, klass_info):
+        """
+        Returns lists of values of objects related to each of the rows
+        (loaded for `fields`), laid out as get_cached_row expects them
+        (with all values None for missing objects).
+        """
+        related_fields, reverse_related_fields = klass_info[3:5]
+        relations = []
+        for field, info in related_fields:
+            if info is not None:
+                position = self._related_position(fields, field)
+                relations.append((info, info[0]._meta.concrete_model._meta.pk,
+                                  [row[position] for row in rows]))
+        pk_position = self._related_position(
+            fields, klass_info[0]._meta.concrete_model._meta.pk)
+        for field, info in reverse_related_fields:
+            if info is not None:
+                relations.append((info, field,
+                                  [row[pk_position] for row in rows]))
+
+        tails = [[] for row in rows]
+        fetched = map_concurrently(
+            lambda relation: self._fetch_related(*relation), relations,
+            self.connection.features.max_query_concurrency)
+        for (info, field, keys), related in zip(relations, fetched):
+            empty = [None] * self._related_width(info)
+            for tail, key in zip(tails, keys):
+                tail.extend(related.get(key, empty))
+        return tails
+
+    def _related_position(self, fields, field):
+        """
+        Returns the position of the value of a field that relations
+        are followed through in rows loaded for the fields.
+        """
+        try:
+            return fields.index(field)
+        except ValueError:
+            raise DatabaseError(
+                "Can't emulate select_related() through %s.%s, the field "
+                "is not loaded (was it deferred?)." %
+                (field.model._meta.object_name, field.name))
+
+    def _fetch_related(self, klass_info, field, keys):
+        """
+        Fetches objects of the model described by the `klass_info`
+        having values of the field among the keys. Returns a dict
+        mapping keys to rows extended with values of further related
+        objects.
+        """
+        keys = list(set(key for key in keys if key is not None))
+        if not keys:
+            return {}
+        model = klass_info[0]._meta.concrete_model
+        field_names = klass_info[1]
+        fields = [f for f in model._meta.concrete_fields
+                  if not field_names or f.attname in field_names]
+        width = len(fields)
+        if field not in fields:
+            fields.append(field)
+
+        rows = []
+        for values in self._in_chunks(keys):
+            query = Query(model)
+            query.add_q(Q(**{'%s__in' % field.name: values}))
+            compiler = query.get_compiler(connection=self.connection)
+            try:
+                entities = compiler.build_query(fields).fetch(0, None)
+            except EmptyResultSet:
+                continue
+            rows.extend(map(compiler._get_decoder(fields), entities))
+
+        position = fields.index(field)
+        return dict((row[position], row[:width] + tail) for row, tail in
+                    zip(rows, self._related_tails(rows, fields, klass_info)))
+
+    def _related_width(self, klass_info):
+        """
+        Returns the number of values get_cached_row consumes for an
+        object described by the `klass_info` (and its related objects).
+        """
+        if klass_info is None:
+            return 0
+        return klass_info[2] + sum(
+            self._related_width(info)
+            for field, info in klass_info[3] + klass_info[4])
+
     def get_fields(self):
         """
         Returns fields which should get loaded from the back-end by the
@@ -614,33 +2044,89 @@ class NonrelInsertCompiler(NonrelCompiler):
           below ever fails).
     """
 
+    @instrumented('insert',
+                  rows=lambda compiler, key: len(compiler.query.objs))
     def execute_sql(self, return_id=False):
         self.pre_sql_setup()
 
-        to_insert = []
         pk_field = self.query.get_meta().pk
+        batch_size = self.connection.features.max_insert_batch_size
+        if batch_size is None:
+            key = self.insert(list(self._iter_insert_values()),
+                              return_id=return_id)
+        else:
+            key = self._insert_batches(batch_size, return_id)
+
+        # Pass the key value through normal database deconversion.
+        return self.ops.convert_values(self.ops.value_from_db(key, pk_field), pk_field)
+
+    def aexecute_sql(self, return_id=False):
+        if self.connection.features.max_insert_batch_size is not None:
+            return super(NonrelInsertCompiler, self).aexecute_sql(return_id)
+        self.pre_sql_setup()
+        pk_field = self.query.get_meta().pk
+        return then(
+            self.ainsert(list(self._iter_insert_values()), return_id),
+            lambda key: self.ops.convert_values(
+                self.ops.value_from_db(key, pk_field), pk_field))
+
+    def _iter_insert_values(self):
+        """
+        Lazily converts objects to be inserted to field.column => value
+        dicts with values prepared for the database.
+        """
+        encode = get_encoder(self.connection, self.query.fields,
+                             self.query.raw)
         for obj in self.query.objs:
-            field_values = {}
-            for field in self.query.fields:
-                value = field.get_db_prep_save(
-                    getattr(obj, field.attname) if self.query.raw else field.pre_save(obj, obj._state.adding),
-                    connection=self.connection
-                )
-                if value is None and not field.null and not field.primary_key:
-                    raise IntegrityError("You can't set %s (a non-nullable "
-                                         "field) to None!" % field.name)
+            yield encode(obj, obj._state.adding)
 
-                # Prepare value for database, note that query.values have
-                # already passed through get_db_prep_save.
-                value = self.ops.value_for_db(value, field)
+    def _insert_batches(self, batch_size, return_id):
+        """
+        Converts objects in batches of at most `batch_size` and calls
+        `insert_many` for each batch. If the pipeline_inserts feature
+        is set, a batch is sent in a separate thread while the next one
+        is being converted.
 
-                field_values[field.column] = value
-            to_insert.append(field_values)
+        Returns the key returned for the last batch.
+        """
+        values = self._iter_insert_values()
+        batches = iter(lambda: list(islice(values, batch_size)), [])
 
-        key = self.insert(to_insert, return_id=return_id)
+        key = None
+        if not self.connection.features.pipeline_inserts:
+            for batch in batches:
+                key = self.insert_many(batch, return_id)
+            return key
 
-        # Pass the key value through normal database deconversion.
-        return self.ops.convert_values(self.ops.value_from_db(key, pk_field), pk_field)
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(1)
+        try:
+            pending = None
+            for batch in batches:
+                if pending is not None:
+                    key = pending.get()
+                pending = pool.apply_async(self.insert_many,
+                                           (batch, return_id))
+            if pending is not None:
+                key = pending.get()
+        finally:
+            pool.close()
+            pool.join()
+        return key
+
+    def insert_many(self, values, return_id):
+        """
+        Inserts a batch of entities when inserting in batches (see the
+        max_insert_batch_size feature). Back-ends may override this to
+        use a bulk API of the database; the default just calls
+        `insert`.
+
+        :param values: A list of field.column => value dicts, with
+                       values prepared for the database
+        :param return_id: Whether to return the id or key of the last
+                          created entity
+        """
+        return self.insert(values, return_id=return_id)
 
     def insert(self, values, return_id):
         """
@@ -658,22 +2144,58 @@ class NonrelInsertCompiler(NonrelCompiler):
         """
         raise NotImplementedError
 
+    def ainsert(self, values, return_id):
+        """
+        Returns an awaitable for the result of insert.
+        """
+        return run_async(self.connection, self.insert, values, return_id)
+
 
 class NonrelUpdateCompiler(NonrelCompiler):
 
+    @instrumented('update', rows=lambda compiler, count: count)
     def execute_sql(self, result_type):
         self.pre_sql_setup()
+        return self._execute_update(*self._get_update_values())
 
+    def aexecute_sql(self, result_type=MULTI):
+        self.pre_sql_setup()
+        values, operators = self._get_update_values()
+        if operators:
+            return run_async(self.connection, self._execute_update, values,
+                             operators)
+        return self.aupdate(values)
+
+    def _execute_update(self, values, operators):
+        """
+        Applies values and operators returned by `_get_update_values`.
+        """
+        if not operators:
+            return self.update(values)
+
+        supported = self.connection.features.supported_update_operators
+        if all(operator in supported for _, operator, _ in operators):
+            return self.update_with_operators(values, [
+                (field, operator,
+                 self._operator_argument_for_db(field, operator, argument))
+                for field, operator, argument in operators])
+        return self._update_in_memory(values, operators)
+
+    def _get_update_values(self):
+        """
+        Splits query values into a list of (field, value) pairs, with
+        values prepared for the database, and a list of (field,
+        operator, argument) triples for in-place update expressions.
+        """
         values = []
+        operators = []
         for field, _, value in self.query.values:
-            if hasattr(value, 'prepare_database_save'):
-                value = value.prepare_database_save(field)
+            operator = self._get_update_operator(field, value)
+            if operator is not None:
+                operators.append((field,) + operator)
             else:
-                value = field.get_db_prep_save(value,
-                                               connection=self.connection)
-            value = self.ops.value_for_db(value, field)
-            values.append((field, value))
-        return self.update(values)
+                values.append((field, self._value_for_save(field, value)))
+        return values, operators
 
     def update(self, values):
         """
@@ -683,15 +2205,184 @@ class NonrelUpdateCompiler(NonrelCompiler):
         """
         raise NotImplementedError
 
+    def aupdate(self, values):
+        """
+        Returns an awaitable for the result of update.
+        """
+        return run_async(self.connection, self.update, values)
+
+    def update_with_operators(self, values, operators):
+        """
+        Changes matching entities, setting some fields to new values
+        and modifying others in place, preferably atomically.
+
+        Only called if all operators are listed in the
+        `supported_update_operators` feature.
+
+        :param values: A list of (field, new-value) pairs
+        :param operators: A list of (field, operator, argument) triples,
+                          see the expressions module for the operators
+        """
+        raise NotImplementedError
+
+    def _value_for_save(self, field, value):
+        # Model instances only stand for their keys in relation fields,
+        # embedded instances are prepared by their fields.
+        if hasattr(value, 'prepare_database_save') and \
+                not (isinstance(value, Model) and field.rel is None):
+            value = value.prepare_database_save(field)
+        else:
+            value = field.get_db_prep_save(value, connection=self.connection)
+        return self.ops.value_for_db(value, field)
+
+    def _get_update_operator(self, field, value):
+        """
+        Returns an (operator, argument) pair for in-place update
+        expressions, None for other values.
+
+        Recognizes the collection expressions and F() arithmetic that
+        adds a number to or subtracts it from the updated field.
+        """
+        if isinstance(value, UpdateOperator):
+            return value.operator, value.argument
+        if not hasattr(value, 'connector'):
+            return None
+
+        # ExpressionNode with two children before Django 1.8,
+        # CombinedExpression with lhs and rhs after.
+        if hasattr(value, 'lhs'):
+            operands = [value.lhs, value.rhs]
+        else:
+            operands = list(value.children)
+        if value.connector in ('+', '-') and len(operands) == 2:
+            lhs, rhs = [getattr(operand, 'value', operand)
+                        for operand in operands]
+            if value.connector == '+' and self._references(rhs, field):
+                lhs, rhs = rhs, lhs
+            if self._references(lhs, field) and \
+                    isinstance(rhs, NUMBER_TYPES) and \
+                    not isinstance(rhs, bool):
+                return 'inc', rhs if value.connector == '+' else -rhs
+        raise DatabaseError("Only adding a number to or subtracting it "
+                            "from the updated field is supported in "
+                            "updates, got %r." % value)
+
+    def _references(self, operand, field):
+        """
+        Checks if an operand is an F() (or a column it resolves to)
+        for the field.
+        """
+        if getattr(operand, 'target', None) is field:
+            return True
+        return getattr(operand, 'name', None) in (field.name, field.attname)
+
+    def _operator_argument_for_db(self, field, operator, argument):
+        if operator == 'inc':
+            return self._value_for_save(field, argument)
+        if operator == 'set_key':
+            key, argument = argument
+            return key, self._item_for_db(field, argument)
+        return self._item_for_db(field, argument)
+
+    def _item_for_db(self, field, item):
+        item_field = field.item_field
+        item = item_field.get_db_prep_save(item, connection=self.connection)
+        return self.ops.value_for_db(item, item_field)
+
+    def _update_in_memory(self, values, operators):
+        """
+        Applies update operators by reading matching entities and
+        writing them back one by one (not atomically -- concurrent
+        changes to the entities may get lost).
+        """
+        pk = self.query.get_meta().pk
+        fields = [pk] + [field for field, _, _ in operators]
+        decode = self._get_decoder(fields)
+        try:
+            entities = list(self.build_query(fields).fetch())
+        except EmptyResultSet:
+            return 0
+        for entity in entities:
+            row = decode(entity)
+            changes = list(values)
+            for (field, operator, argument), value in zip(operators,
+                                                          row[1:]):
+                value = apply_operator(operator, value, argument)
+                changes.append((field, self._value_for_save(field, value)))
+            query = self.query.clone()
+            query.where = query.where_class()
+            query.add_q(Q(pk=row[0]))
+            query.get_compiler(connection=self.connection).update(changes)
+        return len(entities)
+
 
 class NonrelDeleteCompiler(NonrelCompiler):
 
+    @instrumented('delete')
     def execute_sql(self, result_type=MULTI):
+        batch_size = self.connection.features.max_delete_batch_size
+        if batch_size is not None:
+            for _ in self.delete_batches(batch_size):
+                pass
+            return
         try:
             self.build_query([self.query.get_meta().pk]).delete()
         except EmptyResultSet:
             pass
 
+    def aexecute_sql(self, result_type=MULTI):
+        if self.connection.features.max_delete_batch_size is not None:
+            return super(NonrelDeleteCompiler, self).aexecute_sql(
+                result_type)
+        try:
+            return self.build_query([self.query.get_meta().pk]).adelete()
+        except EmptyResultSet:
+            return completed(None)
+
+    def delete_batches(self, batch_size, start_after=None):
+        """
+        Deletes matching entities in batches of up to `batch_size`,
+        walking their primary keys in ascending order, so no more than
+        a batch of keys is ever held in memory.
+
+        After each batch sends the delete_progress signal and yields
+        the number of entities deleted so far and the last deleted
+        key; passing the key as `start_after` resumes an interrupted
+        delete.
+        """
+        pk = self.query.get_meta().pk
+        decode = self._get_decoder([pk])
+        deleted = 0
+        query = self.query.clone()
+        query.clear_ordering(True)
+        query.add_ordering('pk')
+        while True:
+            compiler = query.get_compiler(connection=self.connection)
+            try:
+                nonrel_query = compiler.build_query([pk])
+            except EmptyResultSet:
+                return
+            if start_after is not None:
+                # Deleted entities may still be returned by eventually
+                # consistent back-ends, skip past them explicitly (on
+                # the pushed-down part of the query, if split).
+                getattr(nonrel_query, 'inner', nonrel_query).add_filter(
+                    pk, 'gt', False,
+                    self.ops.value_for_db(start_after, pk, 'gt'))
+            keys = [decode(entity)[0]
+                    for entity in nonrel_query.fetch(0, batch_size)]
+            if not keys:
+                return
+
+            self._delete_by_keys(keys)
+            deleted += len(keys)
+            start_after = keys[-1]
+            delete_progress.send(sender=self.query.model, deleted=deleted,
+                                 last_key=start_after)
+            yield deleted, start_after
+            if len(keys) < batch_size:
+                return
+
 
 class NonrelAggregateCompiler(NonrelCompiler):
     pass
@@ -0,0 +1,298 @@
+"""
+Generation of specialized entity encoding and decoding functions.
+
+Instead of going through generic conversion code for each value, the
+insert and read paths use functions generated for the model fields
+involved, with per-field steps unrolled and steps that are not needed
+for a field (conversions of values that need none, null checks for
+nullable fields) left out. Conversions of items of list, set and dict
+fields (stored as lists, sets or dicts) are unrolled too, recursively
+for nested collections; serialized collections and embedded instances
+still go through the generic conversions.
+
+Functions are cached per connection and list of fields, until cached
+conversion parameters get invalidated (see `conversions_generation`).
+Set the DUMP_CODECS option of a connection to log their source (at the
+debug level, to the "djangotoolbox.codegen" logger); it's also
+available as the `source` attribute of the functions.
+"""
+
+import logging
+
+from django.db.models.fields import Field, NOT_PROVIDED
+from django.db.utils import IntegrityError
+
+from .base import COLLECTION_DB_TYPES, DECONVERTED_FIELD_KINDS, \
+    NonrelDatabaseOperations, conversions_generation, overrides_method
+
+
+logger = logging.getLogger('djangotoolbox.codegen')
+
+
+def _compile(connection, key, name, lines, namespace):
+    source = '\n'.join(lines) + '\n'
+    if connection.settings_dict.get('OPTIONS', {}).get('DUMP_CODECS'):
+        logger.debug('Generated %s:\n%s', key, source)
+    code = compile(source, '<%s>' % key, 'exec')
+    exec(code, namespace)
+    function = namespace[name]
+    function.source = source
+    return function
+
+
+def _get_cached(connection, key):
+    """
+    Returns a cached function, dropping all cached functions if
+    conversion parameters they were generated with may be stale.
+    """
+    if connection.codecs_generation != conversions_generation[0]:
+        connection.codecs.clear()
+        connection.codecs_generation = conversions_generation[0]
+    return connection.codecs[key][1]
+
+
+def _collection_db_type(ops, field):
+    """
+    Returns the parameters computed by `_convert_as` if the field is
+    a collection stored as a list, set or dict that can be converted
+    by generated code, or None.
+    """
+    field, field_kind, db_type = ops._convert_as(field)
+    if db_type not in COLLECTION_DB_TYPES:
+        return None
+    if field_kind == 'ListField' and db_type == 'list' or \
+            field_kind == 'SetField' and db_type in ('list', 'set') or \
+            field_kind == 'DictField' and db_type in ('list', 'dict'):
+        return field, field_kind, db_type
+    return None
+
+
+def _bind(namespace, prefix, value):
+    name = '%s%d' % (prefix, len(namespace))
+    namespace[name] = value
+    return name
+
+
+def _collection(container, item, value, depth, interleaved=False):
+    """
+    Returns an expression building a list, set or dict (container) of
+    items or dict values of the value with the item expression applied
+    to each of them.
+    """
+    key, subvalue = 'key%d' % depth, 'item%d' % depth
+    if container == 'dict':
+        if interleaved:
+            pairs = 'zip(%s[::2], %s[1::2])' % (value, value)
+        else:
+            pairs = '%s.items()' % value
+        return 'dict((%s, %s) for %s, %s in %s)' % (
+            key, item, key, subvalue, pairs)
+    elif container == 'set':
+        return 'set(%s for %s in %s)' % (item, subvalue, value)
+    return '[%s for %s in %s]' % (item, subvalue, value)
+
+
+def _for_db_expression(ops, field, value, namespace, depth=0):
+    """
+    Returns an expression converting a value (not None) of a
+    collection field for storage, doing the same as `_value_for_db`,
+    or None if the field's converter has to be used.
+    """
+    convert_as = _collection_db_type(ops, field)
+    if convert_as is None:
+        return None
+    field, field_kind, db_type = convert_as
+    if field_kind == 'DictField' and db_type == 'list':
+        return None
+    item_field = field.item_field
+    subkind = ops._convert_as(item_field)[1]
+    subvalue = 'item%d' % depth
+    nested = _for_db_expression(ops, item_field, subvalue, namespace,
+                                depth + 1)
+    if nested is not None:
+        item = '(None if %s is None else %s)' % (subvalue, nested)
+    else:
+        converter = ops.get_value_for_db_converter(item_field)
+        if converter is None:
+            item = subvalue
+        else:
+            item = '%s(%s)' % (_bind(namespace, 'convert_item', converter),
+                               subvalue)
+    converted = _collection(db_type, item, value, depth)
+    if subkind in DECONVERTED_FIELD_KINDS:
+        return converted
+
+    # Items that may pass through get copied as a whole (always, for
+    # kinds that need no conversion).
+    copied = '(%s if type(%s) is %s else %s(%s))' % (
+        value, value, db_type, db_type, value)
+    if item == subvalue:
+        return copied
+    return '(%s if %s(%s, %r, %r, %r) else %s)' % (
+        copied, _bind(namespace, 'pass_through', ops._items_pass_through),
+        value, field_kind, subkind, db_type, converted)
+
+
+def _from_db_expression(ops, field, value, namespace, depth=0):
+    """
+    Returns an expression deconverting a value (not None) loaded for
+    a collection field, doing the same as `_value_from_db`, or None if
+    the field's deconverter has to be used.
+    """
+    convert_as = _collection_db_type(ops, field)
+    if convert_as is None:
+        return None
+    field, field_kind, db_type = convert_as
+    container = {'ListField': 'list', 'SetField': 'set',
+                 'DictField': 'dict'}[field_kind]
+    interleaved = container == 'dict' and db_type == 'list'
+    item_field = field.item_field
+
+    # Copy collections of items needing no deconversion.
+    if ops._convert_as(item_field)[1] not in DECONVERTED_FIELD_KINDS:
+        if interleaved:
+            return 'dict(zip(%s[::2], %s[1::2]))' % (value, value)
+        return '%s(%s)' % (container, value)
+
+    subvalue = 'item%d' % depth
+    nested = _from_db_expression(ops, item_field, subvalue, namespace,
+                                 depth + 1)
+    if nested is None:
+        item = '%s(%s)' % (_bind(
+            namespace, 'deconvert_item',
+            ops.get_value_from_db_converter(item_field)), subvalue)
+    else:
+        item = '(None if %s is None else %s)' % (subvalue, nested)
+    return _collection(container, item, value, depth, interleaved)
+
+
+def _unrolls_for_db(ops):
+    return not overrides_method(ops, NonrelDatabaseOperations,
+                                'value_for_db') and \
+        not ops._converts_values()[0]
+
+
+def _unrolls_from_db(ops):
+    return not any(overrides_method(ops, NonrelDatabaseOperations, name)
+                   for name in ('value_from_db', 'convert_values')) and \
+        not ops._converts_values()[1]
+
+
+def get_decoder(connection, fields):
+    """
+    Returns a function decoding an entity (a dict) fetched for the
+    fields into a list of their values.
+
+    Used by NonrelCompiler._get_decoder (unless the compiler overrides
+    _make_result).
+    """
+    key = ('decode',) + tuple(id(field) for field in fields)
+    try:
+        return _get_cached(connection, key)
+    except KeyError:
+        pass
+
+    namespace = {
+        'NOT_PROVIDED': NOT_PROVIDED,
+        'IntegrityError': IntegrityError,
+    }
+    ops = connection.ops
+    unrolls = _unrolls_from_db(ops)
+    lines = ['def decode(entity):']
+    for index, field in enumerate(fields):
+        value = 'value%d' % index
+        lines.append('    %s = entity.get(%r, NOT_PROVIDED)' %
+                     (value, field.column))
+        lines.append('    if %s is NOT_PROVIDED:' % value)
+        lines.append('        %s = default%d()' % (value, index))
+        namespace['default%d' % index] = field.get_default
+        expression = unrolls and _from_db_expression(ops, field, value,
+                                                     namespace)
+        if expression:
+            lines.append('    elif %s is not None:' % value)
+            lines.append('        %s = %s' % (value, expression))
+        else:
+            converter = ops.get_value_from_db_converter(field)
+            if converter is not None:
+                lines.append('    else:')
+                lines.append('        %s = convert%d(%s)' %
+                             (value, index, value))
+                namespace['convert%d' % index] = converter
+        if not field.null:
+            lines.append('    if %s is None:' % value)
+            lines.append('        raise IntegrityError(%r)' % (
+                "Non-nullable field %s can't be None!" % field.name))
+    lines.append('    return [%s]' % ', '.join(
+        'value%d' % index for index in range(len(fields))))
+
+    decoder = _compile(connection, _describe(key[0], fields), 'decode',
+                       lines, namespace)
+    connection.codecs[key] = (fields, decoder)
+    return decoder
+
+
+def get_encoder(connection, fields, raw=False):
+    """
+    Returns a function converting a model instance to a dict mapping
+    columns of the fields to values prepared for the database, taking
+    the instance and a flag telling if it's being added.
+
+    Does the same as NonrelInsertCompiler._iter_insert_values.
+    """
+    key = ('encode', raw) + tuple(id(field) for field in fields)
+    try:
+        return _get_cached(connection, key)
+    except KeyError:
+        pass
+
+    namespace = {
+        'IntegrityError': IntegrityError,
+        'connection': connection,
+    }
+    ops = connection.ops
+    unrolls = _unrolls_for_db(ops)
+    lines = ['def encode(obj, adding):', '    entity = {}']
+    for index, field in enumerate(fields):
+        if raw or not overrides_method(field, Field, 'pre_save'):
+            value = 'obj.%s' % field.attname
+        else:
+            value = 'pre_save%d(obj, adding)' % index
+            namespace['pre_save%d' % index] = field.pre_save
+        lines.append('    value = prepare%d(%s, connection=connection)' %
+                     (index, value))
+        namespace['prepare%d' % index] = field.get_db_prep_save
+        if not field.null and not field.primary_key:
+            lines.append('    if value is None:')
+            lines.append('        raise IntegrityError(%r)' % (
+                "You can't set %s (a non-nullable field) to None!" %
+                field.name))
+        expression = unrolls and _for_db_expression(ops, field, 'value',
+                                                    namespace)
+        if expression:
+            if field.null or field.primary_key:
+                lines.append('    if value is not None:')
+                lines.append('        value = %s' % expression)
+            else:
+                lines.append('    value = %s' % expression)
+            lines.append('    entity[%r] = value' % field.column)
+            continue
+        converter = ops.get_value_for_db_converter(field)
+        if converter is None:
+            lines.append('    entity[%r] = value' % field.column)
+        else:
+            lines.append('    entity[%r] = convert%d(value)' %
+                         (field.column, index))
+            namespace['convert%d' % index] = converter
+    lines.append('    return entity')
+
+    encoder = _compile(connection, _describe(key[0], fields), 'encode',
+                       lines, namespace)
+    connection.codecs[key] = (fields, encoder)
+    return encoder
+
+
+def _describe(kind, fields):
+    if not fields:
+        return kind
+    return '%s %s.%s' % (kind, fields[0].model._meta.object_name,
+                         ','.join(field.name for field in fields))
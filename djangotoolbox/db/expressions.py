@@ -0,0 +1,106 @@
+"""
+In-place update operators.
+
+QuerySet.update() accepts instances of the expressions below for
+collection fields (and F() arithmetic for numbers), for example:
+
+    Post.objects.filter(pk=pk).update(views=F('views') + 1,
+                                      tags=AddToSet('django'))
+
+The update compiler translates them into a list of (field, operator,
+argument) triples, with operators named "inc", "push", "add_to_set",
+"pull" and "set_key". Back-ends declaring support for the operators
+(see `supported_update_operators`) may apply them atomically on the
+server; otherwise entities are read, changed and written back one by
+one.
+"""
+
+from decimal import Decimal
+
+from django.utils import six
+
+
+UPDATE_OPERATORS = ('inc', 'push', 'add_to_set', 'pull', 'set_key')
+
+# Types of numbers that can be added to a field by "inc".
+NUMBER_TYPES = six.integer_types + (float, Decimal)
+
+
+class UpdateOperator(object):
+    """
+    Base of collection mutation expressions.
+    """
+    operator = None
+
+    def __init__(self, item):
+        self.argument = item
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.argument)
+
+    def prepare_database_save(self, field):
+        return self
+
+
+class Push(UpdateOperator):
+    """
+    Appends an item to a list.
+    """
+    operator = 'push'
+
+
+class AddToSet(UpdateOperator):
+    """
+    Adds an item to a set or a list (unless it already contains it).
+    """
+    operator = 'add_to_set'
+
+
+class Pull(UpdateOperator):
+    """
+    Removes all occurrences of an item from a list or a set.
+    """
+    operator = 'pull'
+
+
+class SetKey(UpdateOperator):
+    """
+    Sets the value for a key of a dict.
+    """
+    operator = 'set_key'
+
+    def __init__(self, key, value):
+        self.argument = (key, value)
+
+    def __repr__(self):
+        return 'SetKey(%r, %r)' % self.argument
+
+
+def apply_operator(operator, value, argument):
+    """
+    Returns the result of applying an operator to a value (a copy,
+    the value is not changed).
+    """
+    if operator == 'inc':
+        if value is None:
+            return None
+        return value + argument
+    elif operator == 'push':
+        return list(value or ()) + [argument]
+    elif operator == 'add_to_set':
+        if isinstance(value, (set, frozenset)):
+            return set(value) | set([argument])
+        value = list(value or ())
+        if argument not in value:
+            value.append(argument)
+        return value
+    elif operator == 'pull':
+        if isinstance(value, (set, frozenset)):
+            return set(value) - set([argument])
+        return [item for item in value or () if item != argument]
+    elif operator == 'set_key':
+        key, item = argument
+        value = dict(value or {})
+        value[key] = item
+        return value
+    raise ValueError("Unknown update operator: %s." % operator)
@@ -0,0 +1,156 @@
+"""
+Timing of the phases nonrel compilers go through.
+
+A collector assigned to a connection gets called with the duration of
+each phase: "check", "build" and "filters" (preparing a query), "fetch"
+(waiting for the back-end, including counting) and "decode" (converting
+results to Python), "insert", "update" and "delete", and "compress" and
+"decompress" for compressed values (with their sizes before and after
+compression). Durations of outer phases include the nested ones (e.g.
+"build" includes "check").
+
+    from djangotoolbox.db.instrumentation import HistogramCollector
+    connection.collector = HistogramCollector()
+    ...
+    connection.collector.summary()
+
+With no collector (the default) timing is skipped altogether.
+"""
+
+from bisect import bisect_left
+from functools import wraps
+from threading import Lock
+
+try:
+    from time import monotonic as clock
+except ImportError:
+    from timeit import default_timer as clock
+
+
+class Collector(object):
+    """
+    Interface of phase timing collectors.
+    """
+
+    def record(self, phase, duration, rows=None, **extra):
+        """
+        Called after each phase with its duration in seconds and the
+        number of rows processed (if known); extra keyword arguments
+        are other numbers describing the phase (e.g. sizes).
+        """
+        raise NotImplementedError
+
+
+class PhaseStats(object):
+
+    def __init__(self, bounds):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.counters = {}
+        self.buckets = [0] * (len(bounds) + 1)
+
+
+class HistogramCollector(Collector):
+    """
+    Aggregates durations in memory, counting them in buckets with the
+    given upper bounds (with an additional bucket for longer ones).
+    """
+
+    bounds = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0,
+              5.0)
+
+    def __init__(self, bounds=None):
+        if bounds is not None:
+            self.bounds = tuple(bounds)
+        self.phases = {}
+        self._lock = Lock()
+
+    def record(self, phase, duration, rows=None, **extra):
+        with self._lock:
+            stats = self.phases.get(phase)
+            if stats is None:
+                stats = self.phases[phase] = PhaseStats(self.bounds)
+            stats.count += 1
+            stats.total += duration
+            stats.max = max(stats.max, duration)
+            if rows is not None:
+                stats.rows += rows
+            for name, value in extra.items():
+                stats.counters[name] = stats.counters.get(name, 0) + value
+            stats.buckets[bisect_left(self.bounds, duration)] += 1
+
+    def summary(self):
+        """
+        Returns a dict mapping phases to dicts with their counts, total,
+        mean and maximum durations, rows, sums of other counters passed
+        to record and duration histograms (lists of (upper bound, count)
+        pairs).
+        """
+        with self._lock:
+            return dict((phase, {
+                'count': stats.count,
+                'total': stats.total,
+                'mean': stats.total / stats.count,
+                'max': stats.max,
+                'rows': stats.rows,
+                'counters': dict(stats.counters),
+                'histogram': list(zip(self.bounds + (None,), stats.buckets)),
+            }) for phase, stats in self.phases.items())
+
+    def reset(self):
+        with self._lock:
+            self.phases = {}
+
+
+def instrumented(phase, rows=None):
+    """
+    Decorates a method of a compiler or a query to report its duration
+    to the connection's collector.
+
+    :param rows: A function computing the number of rows from the
+                 object and the method's result
+    """
+    def decorator(method):
+
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            collector = getattr(self.connection, 'collector', None)
+            if collector is None:
+                return method(self, *args, **kwargs)
+            start = clock()
+            result = method(self, *args, **kwargs)
+            collector.record(phase, clock() - start,
+                             None if rows is None else rows(self, result))
+            return result
+        return wrapper
+    return decorator
+
+
+def timed_results(results, decode, finish, fetch_time=0.0):
+    """
+    Decodes entities with the given function, measuring time spent
+    fetching and decoding them. Calls finish(fetch_time, rows,
+    decode_time) once the results are exhausted (or the generator
+    gets closed).
+    """
+    results = iter(results)
+    decode_time = 0.0
+    rows = 0
+    try:
+        while True:
+            start = clock()
+            try:
+                entity = next(results)
+            except StopIteration:
+                fetch_time += clock() - start
+                break
+            fetched = clock()
+            result = decode(entity)
+            decode_time += clock() - fetched
+            fetch_time += fetched - start
+            rows += 1
+            yield result
+    finally:
+        finish(fetch_time, rows, decode_time)
@@ -0,0 +1,332 @@
+"""
+A dict-backed nonrel back-end keeping all data in process memory.
+
+It is meant as a reference implementation of the nonrel back-end API
+and as a stand-in for a real datastore in tests and profiling runs
+(where it lets you measure the overhead of the nonrel layer itself).
+Use it by setting ENGINE to 'djangotoolbox.db.memory'; connections
+using the same NAME share data within a process.
+
+You may request sorted secondary indexes for columns other than those
+of fields with db_index or unique set, through the INDEXES option:
+
+    'OPTIONS': {'INDEXES': {'app_model': ['column', ...]}}
+"""
+from bisect import bisect_left, bisect_right
+from decimal import Decimal
+import threading
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from django.utils.datastructures import SortedDict as OrderedDict
+
+try:
+    from django.db.backends.utils import format_number
+except ImportError:
+    from django.db.backends.util import format_number
+
+from ..base import (
+    NonrelDatabaseClient, NonrelDatabaseFeatures,
+    NonrelDatabaseIntrospection, NonrelDatabaseOperations,
+    NonrelDatabaseValidation, NonrelDatabaseWrapper)
+from ..creation import NonrelDatabaseCreation
+from ..expressions import UPDATE_OPERATORS, apply_operator
+
+try:
+    long
+except NameError:
+    long = int
+
+
+# Field kinds that are never indexed (their values are not orderable
+# or compared item-wise).
+UNINDEXED_FIELD_KINDS = ('AbstractIterableField', 'ListField', 'SetField',
+                         'DictField', 'EmbeddedModelField', 'RawField',
+                         'BlobField')
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(name):
+    """
+    Returns the store for the database name, creating it if needed.
+    """
+    with _stores_lock:
+        try:
+            return _stores[name]
+        except KeyError:
+            store = _stores[name] = MemoryStore()
+            return store
+
+
+def drop_store(name):
+    with _stores_lock:
+        _stores.pop(name, None)
+
+
+def index_key(value):
+    """
+    Makes None orderable against other values (putting it first).
+    """
+    return (value is not None, value)
+
+
+class SortedIndex(object):
+    """
+    Keeps primary keys of a table's entities sorted by a column value.
+    """
+
+    def __init__(self, column):
+        self.column = column
+        self.keys = []
+        self.pks = []
+
+    def add(self, value, pk):
+        key = index_key(value)
+        position = bisect_right(self.keys, key)
+        self.keys.insert(position, key)
+        self.pks.insert(position, pk)
+
+    def remove(self, value, pk):
+        key = index_key(value)
+        position = bisect_left(self.keys, key)
+        end = bisect_right(self.keys, key, position)
+        position += self.pks[position:end].index(pk)
+        del self.keys[position]
+        del self.pks[position]
+
+    def exact(self, value):
+        key = index_key(value)
+        return self.pks[bisect_left(self.keys, key):
+                        bisect_right(self.keys, key)]
+
+    def range(self, lower=None, lower_inclusive=True,
+              upper=None, upper_inclusive=True):
+        """
+        Returns primary keys of entities having values between the
+        bounds (None meaning no bound). Nulls are never included.
+        """
+        if lower is None:
+            start = bisect_right(self.keys, index_key(None))
+        elif lower_inclusive:
+            start = bisect_left(self.keys, index_key(lower))
+        else:
+            start = bisect_right(self.keys, index_key(lower))
+        if upper is None:
+            end = len(self.keys)
+        elif upper_inclusive:
+            end = bisect_right(self.keys, index_key(upper), start)
+        else:
+            end = bisect_left(self.keys, index_key(upper), start)
+        return self.pks[start:end]
+
+
+class MemoryTable(object):
+    """
+    Entities (dicts using columns as keys) of a single table, mapped
+    by primary key, and sorted indexes for some of the columns.
+    """
+
+    def __init__(self, pk_column, indexed_columns=()):
+        self.pk_column = pk_column
+        self.entities = OrderedDict()
+        self.indexes = dict((column, SortedIndex(column))
+                            for column in indexed_columns)
+        self.last_key = 0
+        self.lock = threading.RLock()
+
+    def next_key(self):
+        with self.lock:
+            self.last_key += 1
+            return self.last_key
+
+    def put(self, pk, entity):
+        """
+        Stores an entity, replacing any previous one with the same key.
+        """
+        entity = copy_entity(entity)
+        entity[self.pk_column] = pk
+        with self.lock:
+            old = self.entities.get(pk)
+            if old is not None:
+                self._unindex(pk, old)
+            self.entities[pk] = entity
+            self._index(pk, entity)
+            if isinstance(pk, (int, long)) and pk > self.last_key:
+                self.last_key = pk
+
+    def update(self, pk, values):
+        """
+        Changes some of the columns of an existing entity.
+        """
+        with self.lock:
+            entity = self.entities[pk]
+            self._unindex(pk, entity)
+            entity.update(copy_entity(values))
+            self._index(pk, entity)
+
+    def apply(self, pk, values, operators):
+        """
+        Changes some of the columns of an existing entity and applies
+        update operators to others, atomically.
+        """
+        with self.lock:
+            entity = self.entities[pk]
+            changes = dict(values)
+            for column, operator, argument in operators:
+                changes[column] = apply_operator(
+                    operator, entity.get(column), argument)
+            self.update(pk, changes)
+
+    def delete(self, pk):
+        with self.lock:
+            entity = self.entities.pop(pk, None)
+            if entity is not None:
+                self._unindex(pk, entity)
+
+    def clear(self):
+        with self.lock:
+            self.entities.clear()
+            for column in self.indexes:
+                self.indexes[column] = SortedIndex(column)
+
+    def _index(self, pk, entity):
+        for column, index in list(self.indexes.items()):
+            try:
+                index.add(entity.get(column), pk)
+            except TypeError:
+                # Values that can't be compared with the rest, the
+                # index can't be used for this column.
+                del self.indexes[column]
+
+    def _unindex(self, pk, entity):
+        for column, index in self.indexes.items():
+            index.remove(entity.get(column), pk)
+
+
+class MemoryStore(object):
+    """
+    Tables of a single in-memory database.
+    """
+
+    def __init__(self):
+        self.tables = {}
+        self.lock = threading.Lock()
+
+    def table(self, opts, indexes=()):
+        """
+        Returns the table for model options, creating it (with indexes
+        for the model's indexed fields) on first access.
+        """
+        try:
+            return self.tables[opts.db_table]
+        except KeyError:
+            pass
+        indexed_columns = set(indexes)
+        for field in opts.local_fields:
+            if (field.db_index or field.unique) and not field.primary_key \
+                    and field.get_internal_type() not in \
+                    UNINDEXED_FIELD_KINDS:
+                indexed_columns.add(field.column)
+        with self.lock:
+            return self.tables.setdefault(
+                opts.db_table, MemoryTable(opts.pk.column, indexed_columns))
+
+    def flush(self, table_names=None):
+        with self.lock:
+            if table_names is None:
+                table_names = list(self.tables)
+            for name in table_names:
+                table = self.tables.get(name)
+                if table is not None:
+                    table.clear()
+
+
+def copy_entity(entity):
+    """
+    Copies collections held by an entity, so the stored data can't be
+    changed through objects given to or taken from the store.
+    """
+    entity = dict(entity)
+    for column, value in entity.items():
+        if isinstance(value, (list, set, dict)):
+            entity[column] = type(value)(value)
+    return entity
+
+
+class DatabaseFeatures(NonrelDatabaseFeatures):
+    supported_update_operators = UPDATE_OPERATORS
+
+
+class DatabaseOperations(NonrelDatabaseOperations):
+    compiler_module = __name__.rsplit('.', 1)[0] + '.compiler'
+
+    def value_to_db_decimal(self, value, max_digits, decimal_places):
+        """
+        Stores decimals quantized to the field's decimal places.
+        """
+        if value is None:
+            return None
+        return Decimal(format_number(Decimal(value), max_digits,
+                                     decimal_places))
+
+    def sql_flush(self, style, tables, sequences, *args, **kwargs):
+        """
+        Empties the tables directly, there's no SQL to return.
+        """
+        self.connection.store.flush(tables)
+        return []
+
+
+class DatabaseClient(NonrelDatabaseClient):
+    pass
+
+
+class DatabaseValidation(NonrelDatabaseValidation):
+    pass
+
+
+class DatabaseIntrospection(NonrelDatabaseIntrospection):
+
+    def table_names(self, cursor=None):
+        return list(self.connection.store.tables)
+
+
+class DatabaseCreation(NonrelDatabaseCreation):
+
+    def _create_test_db(self, verbosity, autoclobber):
+        test_database_name = self._get_test_db_name()
+        drop_store(test_database_name)
+        return test_database_name
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        drop_store(test_database_name)
+
+
+class DatabaseWrapper(NonrelDatabaseWrapper):
+    vendor = 'memory'
+
+    def __init__(self, *args, **kwargs):
+        super(DatabaseWrapper, self).__init__(*args, **kwargs)
+        self.features = DatabaseFeatures(self)
+        self.ops = DatabaseOperations(self)
+        self.client = DatabaseClient(self)
+        self.creation = DatabaseCreation(self)
+        self.introspection = DatabaseIntrospection(self)
+        self.validation = DatabaseValidation(self)
+
+    @property
+    def store(self):
+        return get_store(self.settings_dict['NAME'])
+
+    def table(self, opts):
+        """
+        Returns the in-memory table holding entities of a model.
+        """
+        indexes = self.settings_dict.get('OPTIONS', {}).get('INDEXES', {})
+        return self.store.table(opts, indexes.get(opts.db_table, ()))
+
+    def is_usable(self):
+        return True
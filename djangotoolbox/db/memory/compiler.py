@@ -0,0 +1,201 @@
+from django.db.utils import DatabaseError
+
+from ..basecompiler import (
+    EMULATED_OPS, EmptyResultSet, NonrelQuery, NonrelCompiler,
+    NonrelInsertCompiler, NonrelUpdateCompiler, NonrelDeleteCompiler,
+    NonrelAggregateCompiler, NonrelDateCompiler, NonrelDateTimeCompiler)
+
+
+NEGATED_INEQUALITIES = {
+    'lt': 'gte',
+    'lte': 'gt',
+    'gt': 'lte',
+    'gte': 'lt',
+}
+
+
+class MemoryQuery(NonrelQuery):
+    """
+    Scans entities of a single in-memory table, checking them against
+    filters added by the compiler (values of list and set fields match
+    if any of their items does). A sorted index is used to narrow down
+    the candidates if there is one for a filtered column.
+    """
+
+    def __init__(self, compiler, fields):
+        super(MemoryQuery, self).__init__(compiler, fields)
+        self.table = self.connection.table(self.query.get_meta())
+        self.filters = []
+        self.predicates = []
+        self.ordering = True
+
+    def __repr__(self):
+        return '<MemoryQuery: %r ORDER %r>' % (self.filters, self.ordering)
+
+    def fetch(self, low_mark=0, high_mark=None):
+        return iter(self._sort_in_memory(self._matching(), self.ordering,
+                                         low_mark, high_mark))
+
+    def count(self, limit=None):
+        count = len(self._matching())
+        if limit is not None:
+            count = min(count, limit)
+        return count
+
+    def delete(self):
+        for entity in self._matching():
+            self.table.delete(entity[self.table.pk_column])
+
+    def order_by(self, ordering):
+        self.ordering = ordering
+
+    def add_filter(self, field, lookup_type, negated, value):
+        column = field.column
+
+        # Lookup arguments don't go through value_to_db_decimal.
+        if field.get_internal_type() == 'DecimalField' and \
+                lookup_type != 'isnull':
+            to_db = lambda value: self.ops.value_to_db_decimal(
+                value, field.max_digits, field.decimal_places)
+            if isinstance(value, (list, tuple)):
+                value = [to_db(subvalue) for subvalue in value]
+            else:
+                value = to_db(value)
+
+        collection = lookup_type != 'isnull' and \
+            field.get_internal_type() in ('ListField', 'SetField')
+
+        # A negated inequality matches collections with any item
+        # satisfying the opposite inequality.
+        if collection and negated and lookup_type in NEGATED_INEQUALITIES:
+            lookup_type = NEGATED_INEQUALITIES[lookup_type]
+            negated = False
+
+        try:
+            op = EMULATED_OPS[lookup_type]
+        except KeyError:
+            raise DatabaseError("Lookup type %r isn't supported." %
+                                lookup_type)
+
+        if collection:
+            def predicate(entity):
+                for item in entity.get(column) or ():
+                    if item is not None and op(item, value):
+                        return True
+                return False
+        else:
+            predicate = self._make_leaf_predicate(column, lookup_type, value)
+
+        if negated:
+            matches = predicate
+            predicate = lambda entity: not matches(entity)
+
+        self.filters.append((column, lookup_type, negated, value))
+        self.predicates.append(predicate)
+
+    def _matching(self):
+        """
+        Returns a list of entities satisfying all filters.
+        """
+        predicates = self.predicates
+        with self.table.lock:
+            return [entity for entity in self._candidates()
+                    if all(predicate(entity) for predicate in predicates)]
+
+    def _candidates(self):
+        """
+        Returns entities that may match the filters, using an index
+        for an equality or a range filter if possible.
+        """
+        entities = self.table.entities
+        indexes = self.table.indexes
+        bounds = {}
+        try:
+            for column, lookup_type, negated, value in self.filters:
+                index = indexes.get(column)
+                if index is None or negated:
+                    continue
+                if lookup_type == 'exact':
+                    return [entities[pk] for pk in index.exact(value)]
+                elif lookup_type == 'in':
+                    pks = set()
+                    for subvalue in value:
+                        pks.update(index.exact(subvalue))
+                    return [entities[pk] for pk in pks]
+                elif lookup_type in ('gt', 'gte', 'lt', 'lte'):
+                    bounds.setdefault(column, {}).setdefault(lookup_type,
+                                                             value)
+
+            # Any single lower and upper bound give a superset of the
+            # matching entities.
+            for column, column_bounds in bounds.items():
+                lower, upper = None, None
+                lower_inclusive, upper_inclusive = True, True
+                if 'gt' in column_bounds:
+                    lower, lower_inclusive = column_bounds['gt'], False
+                elif 'gte' in column_bounds:
+                    lower = column_bounds['gte']
+                if 'lt' in column_bounds:
+                    upper, upper_inclusive = column_bounds['lt'], False
+                elif 'lte' in column_bounds:
+                    upper = column_bounds['lte']
+                return [entities[pk] for pk in indexes[column].range(
+                    lower, lower_inclusive, upper, upper_inclusive)]
+        except TypeError:
+            # Lookup value not comparable with indexed values.
+            pass
+        return list(entities.values())
+
+
+class SQLCompiler(NonrelCompiler):
+    query_class = MemoryQuery
+
+
+class SQLInsertCompiler(NonrelInsertCompiler, SQLCompiler):
+
+    def insert(self, values, return_id):
+        table = self.connection.table(self.query.get_meta())
+        key = None
+        for entity in values:
+            key = entity.get(table.pk_column)
+            if key is None:
+                key = table.next_key()
+            table.put(key, entity)
+        return key
+
+
+class SQLUpdateCompiler(NonrelUpdateCompiler, SQLCompiler):
+
+    def update(self, values):
+        return self.update_with_operators(values, [])
+
+    def update_with_operators(self, values, operators):
+        opts = self.query.get_meta()
+        table = self.connection.table(opts)
+        changes = [(field.column, value) for field, value in values]
+        operators = [(field.column, operator, argument)
+                     for field, operator, argument in operators]
+        try:
+            entities = self.build_query([opts.pk]).fetch()
+        except EmptyResultSet:
+            return 0
+        pks = [entity[table.pk_column] for entity in entities]
+        for pk in pks:
+            table.apply(pk, changes, operators)
+        return len(pks)
+
+
+class SQLDeleteCompiler(NonrelDeleteCompiler, SQLCompiler):
+    pass
+
+
+class SQLAggregateCompiler(NonrelAggregateCompiler, SQLCompiler):
+    pass
+
+
+class SQLDateCompiler(NonrelDateCompiler, SQLCompiler):
+    pass
+
+
+class SQLDateTimeCompiler(NonrelDateTimeCompiler, SQLCompiler):
+    pass
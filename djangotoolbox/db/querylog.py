@@ -0,0 +1,96 @@
+"""
+Structured log of queries executed by nonrel back-ends.
+
+Each connection keeps the most recent query records in a ring buffer of
+fixed capacity (`connection.query_log`). Records hold the rendered
+query and filters, its limits and some measurements -- but not the
+query itself, so logged queries don't keep their constraint trees (and
+lookup arguments) alive. Only sampled queries get rendered, so logging
+a small sample of production queries costs little.
+"""
+
+from collections import deque
+from random import random
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+
+RECORD_KEYS = ('sql', 'time', 'model', 'filters', 'ordering', 'low_mark',
+               'high_mark', 'rows', 'fetch_time', 'decode_time')
+
+
+class QueryRecord(Mapping):
+    """
+    A logged query, readable as a dict with the "sql" and "time" keys
+    (like the entries of `connection.queries`) and a couple of others.
+
+    Times are in seconds; "fetch_time" is spent waiting for the
+    back-end, "decode_time" on converting values to Python.
+    """
+
+    def __init__(self, sql, model, filters, ordering, low_mark, high_mark):
+        self.sql = sql
+        self.model = model
+        self.filters = filters
+        self.ordering = ordering
+        self.low_mark = low_mark
+        self.high_mark = high_mark
+        self.rows = None
+        self.fetch_time = None
+        self.decode_time = None
+
+    def finish(self, fetch_time, rows, decode_time=0.0):
+        self.fetch_time = fetch_time
+        self.rows = rows
+        self.decode_time = decode_time
+
+    def __getitem__(self, key):
+        if key not in RECORD_KEYS:
+            raise KeyError(key)
+        if key == 'time':
+            return '%.3f' % ((self.fetch_time or 0) + (self.decode_time or 0))
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(RECORD_KEYS)
+
+    def __len__(self):
+        return len(RECORD_KEYS)
+
+    def __repr__(self):
+        return '<QueryRecord: %s>' % self['sql']
+
+
+class QueryLog(object):
+    """
+    Ring buffer of the `capacity` most recent query records.
+
+    Queries are only logged at the given sampling rate (a fraction
+    between 0 and 1), unless the connection is in the debug mode.
+    """
+
+    def __init__(self, capacity=100, sample_rate=0.0):
+        self.sample_rate = sample_rate
+        self.records = deque(maxlen=capacity)
+
+    def sample(self):
+        """
+        Decides if the next query should be logged.
+        """
+        return self.sample_rate > 0 and random() < self.sample_rate
+
+    def append(self, record):
+        self.records.append(record)
+
+    def clear(self):
+        self.records.clear()
+
+    def __iter__(self):
+        return iter(list(self.records))
+
+    def __len__(self):
+        return len(self.records)
+
@@ -0,0 +1,154 @@
+"""
+Serializers for collections and embedded instances stored using the
+"bytes" or "string" db_types.
+
+Serialized values start with a byte telling which serializer produced
+them, so the serializer used for new values may be changed without
+breaking reads of existing data; values without a known tag are
+untagged pickles written by earlier versions.
+
+Built in serializers:
+-- "pickle": pickle using its highest protocol, handles any values;
+-- "marshal": faster, for values built of basic types only (and
+   specific to the Python version);
+-- "json": for values built of basic types, safe to load from
+   untrusted sources (sets are stored as lists).
+
+The serializer may be chosen with the SERIALIZER connection option or
+the `serializer` argument of collection and embedded model fields.
+Other serializers can be added using `register_serializer`.
+
+Serialized values may also be compressed (with "zlib", "bz2" or, on
+Python 3, "lzma"), in which case they start with the compressor's tag
+followed by the compressed serialized value.
+"""
+
+import bz2
+import json
+import marshal
+import zlib
+
+from django.utils.six.moves import cPickle as pickle
+
+
+class Serializer(object):
+
+    def __init__(self, name, tag, dumps, loads):
+        self.name = name
+        self.tag = tag
+        self.dumps = dumps
+        self.loads = loads
+
+
+_serializers = {}
+_compressors = {}
+_compressor_tags = {}
+_tags = {}
+
+
+def _check_tag(tag, name):
+    if len(tag) != 1 or not b'\x00' < tag < b' ':
+        raise ValueError("Invalid tag %r." % tag)
+    if tag in _tags and _tags[tag].name != name:
+        raise ValueError("Tag %r is already used by %s." %
+                         (tag, _tags[tag].name))
+
+
+def register_serializer(name, tag, dumps, loads):
+    """
+    Registers a pair of functions turning values into bytes and back
+    under a name and a tag: a single control byte (that can't start
+    a pickle), distinct for each serializer and compressor.
+    """
+    _check_tag(tag, name)
+    serializer = Serializer(name, tag, dumps, loads)
+    _serializers[name] = _tags[tag] = serializer
+
+
+def register_compressor(name, tag, compress, decompress):
+    """
+    Registers a pair of functions compressing and decompressing bytes,
+    see `register_serializer` for the tag.
+    """
+    _check_tag(tag, name)
+    compressor = Serializer(name, tag, compress, decompress)
+    _compressors[name] = _compressor_tags[tag] = _tags[tag] = compressor
+
+
+def get_serializer(name):
+    try:
+        return _serializers[name]
+    except KeyError:
+        raise ValueError("Unknown serializer: %s." % name)
+
+
+def serialize(value, name):
+    """
+    Serializes the value with the given serializer, prefixing the
+    result with its tag.
+    """
+    serializer = get_serializer(name)
+    return serializer.tag + serializer.dumps(value)
+
+
+def compress(data, name):
+    """
+    Compresses serialized data with the given compressor, prefixing
+    the result with its tag.
+    """
+    try:
+        compressor = _compressors[name]
+    except KeyError:
+        raise ValueError("Unknown compressor: %s." % name)
+    return compressor.tag + compressor.dumps(data)
+
+
+def is_compressed(data):
+    return data[:1] in _compressor_tags
+
+
+def decompress(data):
+    """
+    Returns serialized data, decompressing it if it's compressed.
+    """
+    compressor = _compressor_tags.get(data[:1])
+    if compressor is None:
+        return data
+    return compressor.loads(data[1:])
+
+
+def deserialize(data):
+    """
+    Loads a value serialized by any of the serializers (and possibly
+    compressed), or an untagged pickle.
+    """
+    data = decompress(data)
+    serializer = _tags.get(data[:1])
+    if serializer is None:
+        return pickle.loads(data)
+    return serializer.loads(data[1:])
+
+
+def _json_dumps(value):
+    return json.dumps(value, default=list,
+                      separators=(',', ':')).encode('utf-8')
+
+
+def _json_loads(data):
+    return json.loads(data.decode('utf-8'))
+
+
+register_serializer('marshal', b'\x01', marshal.dumps, marshal.loads)
+register_serializer('json', b'\x02', _json_dumps, _json_loads)
+register_serializer('pickle', b'\x03',
+                    lambda value: pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                    pickle.loads)
+
+register_compressor('zlib', b'\x10', zlib.compress, zlib.decompress)
+register_compressor('bz2', b'\x11', bz2.compress, bz2.decompress)
+try:
+    import lzma
+except ImportError:
+    pass
+else:
+    register_compressor('lzma', b'\x12', lzma.compress, lzma.decompress)
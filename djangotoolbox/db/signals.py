@@ -0,0 +1,8 @@
+from django.dispatch import Signal
+
+
+# Sent after each batch of a batched delete (see the
+# max_delete_batch_size feature), with the model as the sender.
+# `deleted` is the number of entities deleted so far, `last_key` the
+# greatest primary key deleted, that a delete can be resumed after.
+delete_progress = Signal(providing_args=['deleted', 'last_key'])
@@ -1,6 +1,198 @@
+import heapq
+from tempfile import TemporaryFile
+from threading import Lock
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from django.utils.datastructures import SortedDict as OrderedDict
+
+from django.utils.six.moves import cPickle as pickle
+
 from django.db.backends.util import format_number
 
 
+def map_concurrently(function, items, concurrency=1):
+    """
+    Returns a list with results of applying the function to each of
+    the items, using up to `concurrency` threads.
+    """
+    items = list(items)
+    if concurrency <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(concurrency, len(items)))
+    try:
+        return pool.map(function, items)
+    finally:
+        pool.close()
+
+
+class QueryPlanCache(object):
+    """
+    A bounded, least-recently-used mapping from query shapes to
+    compiled query plans.
+
+    Counts lookups that found (`hits`) and didn't find a plan
+    (`misses`); a size of 0 disables caching.
+    """
+
+    def __init__(self, size=500):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._plans = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._plans)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                plan = self._plans.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._plans[key] = plan
+            self.hits += 1
+            return plan
+
+    def put(self, key, plan):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._plans.pop(key, None)
+            self._plans[key] = plan
+            while len(self._plans) > self.size:
+                # SortedDict.popitem() doesn't take the "last" argument.
+                del self._plans[next(iter(self._plans))]
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+            self.hits = self.misses = 0
+
+
+def freeze(value):
+    """
+    Returns a hashable equivalent of a (possibly nested) collection.
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    elif isinstance(value, (set, frozenset)):
+        return frozenset(freeze(item) for item in value)
+    elif isinstance(value, dict):
+        return frozenset((key, freeze(item)) for key, item in value.items())
+    return value
+
+
+def _write_run(items):
+    run = TemporaryFile()
+    for item in items:
+        pickle.dump(item, run, pickle.HIGHEST_PROTOCOL)
+    run.seek(0)
+    return run
+
+
+def _read_run(run):
+    try:
+        while True:
+            try:
+                yield pickle.load(run)
+            except EOFError:
+                return
+    finally:
+        run.close()
+
+
+def external_sort(items, run_size):
+    """
+    Sorts an iterable keeping at most `run_size` items in memory;
+    sorted runs are spilled to temporary files and then merged.
+
+    Items should be tuples that can be ordered by a unique prefix.
+    """
+    runs = []
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= run_size:
+            chunk.sort()
+            runs.append(_write_run(chunk))
+            chunk = []
+    chunk.sort()
+    if not runs:
+        return iter(chunk)
+    if chunk:
+        runs.append(_write_run(chunk))
+    return heapq.merge(*[_read_run(run) for run in runs])
+
+
+def unique_rows(rows, memory_limit=None):
+    """
+    Yields rows (sequences of values) skipping ones equal to any of
+    the previous rows, in the original order.
+
+    Rows are streamed while the number of distinct rows seen doesn't
+    exceed `memory_limit`. Past it the remaining rows get spilled to
+    disk: sorted by hash, de-duplicated and sorted back to the input
+    order, so they are only yielded when the input gets exhausted.
+    """
+    seen = set()
+    rows = iter(rows)
+    for row in rows:
+        key = freeze(row)
+        if key in seen:
+            continue
+        seen.add(key)
+        yield row
+        if memory_limit is not None and len(seen) >= memory_limit:
+            break
+    else:
+        return
+
+    # Rows equal to the ones already yielded can still be dropped
+    # early, others get sorted by their hashes, so equal rows end up
+    # next to each other (along with rows having colliding hashes).
+    def spilled():
+        for seq, row in enumerate(rows):
+            key = freeze(row)
+            if key not in seen:
+                yield hash(key), seq, key, row
+
+    def deduplicated():
+        group_hash = None
+        group = []
+        for key_hash, seq, key, row in external_sort(spilled(),
+                                                     memory_limit):
+            if key_hash != group_hash:
+                group_hash = key_hash
+                group = []
+            if key in group:
+                continue
+            group.append(key)
+            yield seq, row
+
+    for seq, row in external_sort(deduplicated(), memory_limit):
+        yield row
+
+
+def delete_in_batches(queryset, batch_size, start_after=None):
+    """
+    Deletes objects matching a queryset in batches of primary keys (as
+    a "fast" delete, not collecting related objects nor sending model
+    signals). Yields the number of objects deleted so far and the last
+    deleted key after each batch; an interrupted delete may be resumed
+    by passing the last key reported as `start_after`.
+    """
+    from django.db.models.sql.subqueries import DeleteQuery
+    query = queryset.query.clone(klass=DeleteQuery)
+    compiler = query.get_compiler(queryset.db)
+    return compiler.delete_batches(batch_size, start_after)
+
+
 def decimal_to_string(value, max_digits=16, decimal_places=0):
     """
     Converts decimal to a unicode string for storage / lookup by nonrel
@@ -0,0 +1,209 @@
+"""
+Columnar evaluation of in-memory filters and ordering using NumPy.
+
+Entities are transposed into an array per referenced column, constraint
+leaves are evaluated as boolean masks and combined according to the
+constraint tree, and sorting is done with a single `lexsort`.
+
+Only columns holding numbers or strings (and None) are supported,
+anything else raises `Unsupported`, letting callers fall back to
+evaluating entities one by one. Nulls are treated like in the scalar
+path (see NULL_COMPARISONS in basecompiler): they only satisfy "lt",
+"lte" and "isnull" constraints and sort before other values.
+"""
+
+from functools import reduce
+
+from django.utils import six
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+    isin = None
+else:
+    isin = getattr(numpy, 'isin', None) or numpy.in1d
+
+
+# Groups of types whose values can be stored in a single array without
+# changing the results of comparisons. Integers and floats are kept
+# apart (an array holding both is of floats, that can't represent all
+# integers exactly), and so are byte strings and text (comparing them
+# may fail on Python 2).
+INTEGER_TYPES = six.integer_types
+FLOAT_TYPES = (float,)
+if six.PY2:
+    FAMILIES = (INTEGER_TYPES, FLOAT_TYPES, (str,), (unicode,))
+else:
+    FAMILIES = (INTEGER_TYPES, FLOAT_TYPES, (str,), (bytes,))
+
+# Integers that floats represent exactly.
+MAX_EXACT_FLOAT = 2 ** 53
+
+COMPARISONS = {
+    'exact': lambda x, y: x == y,
+    'lt': lambda x, y: x < y,
+    'lte': lambda x, y: x <= y,
+    'gt': lambda x, y: x > y,
+    'gte': lambda x, y: x >= y,
+}
+
+
+class Unsupported(Exception):
+    """
+    Raised for values or constraints that can't be vectorized.
+    """
+
+
+def _family(values):
+    """
+    Returns the tuple of types all the values belong to.
+    """
+    types = set(type(value) for value in values)
+    for family in FAMILIES:
+        if all(issubclass(type_, family) for type_ in types):
+            return family
+    raise Unsupported()
+
+
+class Columns(object):
+    """
+    Lazily transposes a list of entities into arrays of column values.
+    """
+
+    def __init__(self, entities):
+        self.entities = entities
+        self.size = len(entities)
+        self._nulls = {}
+        self._columns = {}
+
+    def nulls(self, column):
+        """
+        Returns a mask of entities having None for the column.
+        """
+        try:
+            return self._nulls[column]
+        except KeyError:
+            pass
+        nulls = self._nulls[column] = numpy.fromiter(
+            (entity.get(column) is None for entity in self.entities),
+            bool, self.size)
+        return nulls
+
+    def get(self, column):
+        """
+        Returns an (array, nulls mask, family of types) tuple for the
+        column; nulls are replaced with a placeholder in the array.
+        """
+        try:
+            return self._columns[column]
+        except KeyError:
+            pass
+        values = [entity.get(column) for entity in self.entities]
+        family = _family(value for value in values if value is not None)
+        placeholder = family[0]()
+        try:
+            array = numpy.array([placeholder if value is None else value
+                                 for value in values])
+        except (OverflowError, ValueError):
+            raise Unsupported()
+        if array.dtype.kind not in 'biufSU':
+            raise Unsupported()
+        result = self._columns[column] = (array, self.nulls(column), family)
+        return result
+
+
+def _check(value, family):
+    """
+    Checks if a lookup argument can be compared with an array of values
+    of the family without losing precision.
+    """
+    if isinstance(value, family):
+        return
+    # Integers are only compared with floats if converting them to
+    # floats is exact (the other way around the array would get
+    # converted).
+    if family is FLOAT_TYPES and isinstance(value, INTEGER_TYPES) and \
+            -MAX_EXACT_FLOAT <= value <= MAX_EXACT_FLOAT:
+        return
+    raise Unsupported()
+
+
+def leaf_mask(columns, column, lookup_type, value):
+    """
+    Evaluates a single constraint for all entities.
+    """
+    if lookup_type == 'isnull':
+        nulls = columns.nulls(column)
+        return nulls if value else ~nulls
+
+    array, nulls, family = columns.get(column)
+    if lookup_type == 'in':
+        value = list(value)
+        for item in value:
+            _check(item, family)
+        if not value:
+            return numpy.zeros(columns.size, bool)
+        mask = isin(array, numpy.array(value))
+    elif lookup_type in ('range', 'year'):
+        lower, upper = value
+        _check(lower, family)
+        _check(upper, family)
+        if lookup_type == 'year':
+            mask = (array >= lower) & (array < upper)
+        else:
+            mask = (array >= lower) & (array <= upper)
+    elif lookup_type in COMPARISONS:
+        _check(value, family)
+        mask = COMPARISONS[lookup_type](array, value)
+    else:
+        raise Unsupported()
+
+    if lookup_type in ('lt', 'lte'):
+        return mask | nulls
+    return mask & ~nulls
+
+
+def tree_mask(tree, columns):
+    """
+    Evaluates a tree of ('node', connector, negated, children) and
+    ('leaf', column, lookup type, value) tuples.
+    """
+    if tree[0] == 'leaf':
+        return leaf_mask(columns, *tree[1:])
+    _, connector, negated, children = tree
+    if not children:
+        mask = numpy.ones(columns.size, bool)
+    else:
+        masks = [tree_mask(child, columns) for child in children]
+        if connector == 'AND':
+            mask = reduce(numpy.logical_and, masks)
+        else:
+            mask = reduce(numpy.logical_or, masks)
+    if negated:
+        return ~mask
+    return mask
+
+
+def select(entities, tree):
+    """
+    Returns a list of entities satisfying the constraints tree.
+    """
+    mask = tree_mask(tree, Columns(entities))
+    return [entities[index] for index in numpy.flatnonzero(mask)]
+
+
+def argsort(entities, ordering):
+    """
+    Returns indices that would sort entities according to a list of
+    (column, ascending) pairs (stably, like sorted would).
+    """
+    columns = Columns(entities)
+    keys = []
+    for column, ascending in ordering:
+        array, nulls, family = columns.get(column)
+        ranks = numpy.unique(array, return_inverse=True)[1] + 1
+        ranks[nulls] = 0
+        keys.append(ranks if ascending else -ranks)
+    # The last key passed to lexsort is the primary one.
+    return numpy.lexsort(keys[::-1])
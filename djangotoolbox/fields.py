@@ -50,9 +50,14 @@ class AbstractIterableField(models.Field):
     If you do, the iterable items will be piped through the passed
     field's validation and conversion routines, converting the items
     to the appropriate data type.
+
+    The `serializer` argument selects how collections are serialized
+    if the back-end stores them using the "bytes" or "string" db_type.
     """
 
     def __init__(self, item_field=None, *args, **kwargs):
+        self.serializer = kwargs.pop('serializer', None)
+
         default = kwargs.get(
             'default', None if kwargs.get('null') else EMPTY_ITER)
 
@@ -240,6 +245,9 @@ class EmbeddedModelField(models.Field):
     :param embedded_model: (optional) The model class of instances we
                            will be embedding; may also be passed as a
                            string, similar to relation fields
+    :param serializer: (optional) Name of the serializer used if the
+                       back-end stores embedded instances serialized
+                       (see djangotoolbox.db.serializers)
 
     TODO: Make sure to delegate all signals and other field methods to
           the embedded instance (not just pre_save, get_db_prep_* and
@@ -249,6 +257,7 @@ class EmbeddedModelField(models.Field):
 
     def __init__(self, embedded_model=None, *args, **kwargs):
         self.embedded_model = embedded_model
+        self.serializer = kwargs.pop('serializer', None)
         kwargs.setdefault('default', None)
         super(EmbeddedModelField, self).__init__(*args, **kwargs)
 
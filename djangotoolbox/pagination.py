@@ -0,0 +1,141 @@
+"""
+Keyset ("cursor") pagination.
+
+Instead of skipping the rows of previous pages (which back-ends have to
+do one by one for offsets), the next page is selected with a range
+constraint on the ordering fields, starting after the values of the
+last row of the previous page. The primary key is always used as the
+last ordering field, so rows having equal values for the other fields
+are neither skipped nor repeated.
+
+    objects, cursor = paginate(Post.objects.order_by('-date'), 20)
+    ...
+    objects, cursor = paginate(Post.objects.order_by('-date'), 20, cursor)
+
+Cursors are opaque, signed strings (None after the last page). Only
+ordering by fields of the queried model is supported.
+"""
+
+from django.core import signing
+from django.db.models import Q
+
+
+SALT = 'djangotoolbox.pagination'
+
+
+class InvalidCursor(ValueError):
+    """
+    Raised for cursors that were tampered with or that were created
+    for a query with a different ordering.
+    """
+
+
+def get_ordering(queryset):
+    """
+    Returns a list of (field, ascending) pairs the queryset will be
+    paginated by: its own ordering followed by the primary key.
+    """
+    compiler = queryset.query.get_compiler(queryset.db)
+    ordering = compiler._get_ordering()
+    pk = queryset.model._meta.pk
+    if isinstance(ordering, bool):
+        return [(pk, ordering)]
+    if pk not in [field for field, ascending in ordering]:
+        ordering.append((pk, True))
+    return ordering
+
+
+def _order_names(ordering):
+    return [('' if ascending else '-') + field.name
+            for field, ascending in ordering]
+
+
+def encode_cursor(ordering, obj):
+    values = []
+    for field, ascending in ordering:
+        if getattr(obj, field.attname) is None:
+            values.append(None)
+        else:
+            values.append(field.value_to_string(obj))
+    return signing.dumps({
+        'ordering': _order_names(ordering),
+        'values': values,
+    }, salt=SALT, compress=True)
+
+
+def decode_cursor(ordering, cursor):
+    """
+    Returns values of the ordering fields stored in the cursor.
+    """
+    try:
+        data = signing.loads(cursor, salt=SALT)
+    except signing.BadSignature:
+        raise InvalidCursor("Invalid pagination cursor.")
+    if data['ordering'] != _order_names(ordering):
+        raise InvalidCursor("The pagination cursor was created for a "
+                            "different ordering.")
+    return [None if value is None else field.to_python(value)
+            for (field, ascending), value in zip(ordering, data['values'])]
+
+
+def _after(field, ascending, value):
+    """
+    Returns a Q selecting rows following the value in the ordering
+    (with nulls ordered before other values), or None if there are
+    no such rows.
+    """
+    if value is None:
+        if ascending:
+            return Q(**{field.name + '__isnull': False})
+        return None
+    condition = Q(**{field.name + ('__gt' if ascending else '__lt'): value})
+    if not ascending and field.null:
+        condition |= Q(**{field.name + '__isnull': True})
+    return condition
+
+
+def _equal(field, value):
+    if value is None:
+        return Q(**{field.name + '__isnull': True})
+    return Q(**{field.name: value})
+
+
+def seek(queryset, ordering, values):
+    """
+    Filters the queryset to rows following the values (of the ordering
+    fields) in the ordering: rows equal on the first n - 1 fields and
+    following the value of the n-th one, for any n.
+    """
+    condition = None
+    for index, (field, ascending) in enumerate(ordering):
+        branch = _after(field, ascending, values[index])
+        if branch is None:
+            continue
+        for other_index, (other, _) in enumerate(ordering[:index]):
+            branch &= _equal(other, values[other_index])
+        condition = branch if condition is None else condition | branch
+    if condition is None:
+        return queryset.none()
+    return queryset.filter(condition)
+
+
+def paginate(queryset, page_size, cursor=None):
+    """
+    Returns a list of up to `page_size` objects following the cursor
+    (or from the start if the cursor is None) and the cursor for the
+    next page (None if there are no more objects).
+    """
+    if not queryset.query.can_filter():
+        raise TypeError("Cannot paginate a sliced queryset.")
+    ordering = get_ordering(queryset)
+    queryset = queryset.order_by(*_order_names(ordering))
+    queryset.query.standard_ordering = True
+    if cursor is not None:
+        queryset = seek(queryset, ordering,
+                        decode_cursor(ordering, cursor))
+
+    objects = list(queryset[:page_size + 1])
+    if len(objects) <= page_size:
+        return objects, None
+    objects = objects[:page_size]
+    return objects, encode_cursor(ordering, objects[-1])
@@ -1,16 +1,36 @@
 from __future__ import with_statement
+from collections import deque
+import datetime
 from decimal import Decimal, InvalidOperation
+import sys
 import time
 
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
 from django.core import serializers
-from django.db import models
-from django.db.models import Q
-from django.db.models.signals import post_save
-from django.db.utils import DatabaseError
+from django.db import connection, models
+from django.db.models import Avg, Count, F, Max, Min, Q, Sum
+from django.db.models.signals import class_prepared, post_save
+from django.db.utils import DatabaseError, IntegrityError
 from django.dispatch.dispatcher import receiver
 from django.test import TestCase
-from django.utils.unittest import expectedFailure, skip
-
+from django.utils.six.moves import cPickle as pickle
+from django.utils.unittest import expectedFailure, skip, skipIf
+
+from .db.asynchronous import AsyncIterator, shutdown_executor
+from .db.basecompiler import EmptyResultSet
+from .db.codegen import get_decoder, get_encoder
+from .db.expressions import AddToSet, Pull, Push, SetKey
+from .db.instrumentation import HistogramCollector
+from .db.memory.base import SortedIndex
+from .db.serializers import deserialize, serialize
+from .db.signals import delete_progress
+from .db.utils import QueryPlanCache, delete_in_batches, unique_rows
+from .db.vectorized import Columns, Unsupported, leaf_mask, numpy, select
+from .pagination import InvalidCursor, paginate
 from .fields import ListField, SetField, DictField, EmbeddedModelField
 
 
@@ -58,6 +78,11 @@ class ListModel(models.Model):
     names_nullable = ListField(models.CharField(max_length=500), null=True)
 
 
+class NestedListModel(models.Model):
+    lists = ListField(ListField(models.IntegerField()))
+    embedded = ListField(EmbeddedModelField('SetModel'))
+
+
 class OrderedListModel(models.Model):
     ordered_ints = ListField(models.IntegerField(max_length=500), default=[],
                              ordering=count_calls(lambda x: x), null=True)
@@ -522,6 +547,33 @@ class SelectRelatedTest(TestCase):
         self.assertEqual(source.target.pk, target.pk)
         self.assertEqual(source.target.index, target.index)
 
+    def test_emulated(self):
+        connection.features.select_related_chunk_size = 2
+        try:
+            targets = [Target.objects.create(index=index)
+                       for index in range(2)]
+            for index in range(3):
+                Source.objects.create(target=targets[index % 2], index=index)
+
+            # One query for sources and one for each chunk of them.
+            with self.assertNumQueries(3):
+                sources = list(Source.objects.select_related('target')
+                               .order_by('index'))
+                self.assertEqual(
+                    [source.target.index for source in sources], [0, 1, 0])
+            source = Source.objects.select_related().get(index=1)
+            with self.assertNumQueries(0):
+                self.assertEqual(source.target.index, 1)
+        finally:
+            del connection.features.select_related_chunk_size
+
+    def test_unloaded_relation(self):
+        compiler = Source.objects.all().query.get_compiler(
+            connection=connection)
+        field = Source._meta.get_field('target')
+        self.assertRaises(DatabaseError, compiler._related_position,
+                          [Source._meta.pk], field)
+
 
 class DBColumn(models.Model):
     a = models.IntegerField(db_column='b')
@@ -699,6 +751,929 @@ class FeaturesTest(TestCase):
             Source.objects.get(target__in=list(targets)),
             source)
 
+    def test_evaluated_subqueries(self):
+        features = connection.features
+        old_features = (features.evaluate_subqueries,
+                        features.max_in_filter_values)
+        features.evaluate_subqueries = True
+        features.max_in_filter_values = 2
+        try:
+            targets = [Target.objects.create(index=index)
+                       for index in range(5)]
+            for target in targets:
+                Source.objects.create(index=target.index, target=target)
+            self.assertEqual(
+                [source.index for source in Source.objects.filter(
+                    target__in=Target.objects.filter(index__gte=1))
+                    .order_by('index')],
+                [1, 2, 3, 4])
+            self.assertEqual(Source.objects.filter(
+                target__in=Target.objects.filter(index__gte=5)).count(), 0)
+        finally:
+            (features.evaluate_subqueries,
+             features.max_in_filter_values) = old_features
+
+
+class OrFilterTest(TestCase):
+    """
+    Alternatives of filters are emulated by merging results of
+    multiple queries on back-ends that don't support them.
+    """
+
+    def setUp(self):
+        for index in range(1, 6):
+            Target.objects.create(index=index)
+
+    def indexes(self, queryset):
+        return [target.index for target in queryset]
+
+    def test_or(self):
+        self.assertEqual(
+            self.indexes(Target.objects.filter(
+                Q(index=1) | Q(index__gte=4)).order_by('index')),
+            [1, 4, 5])
+
+    def test_overlapping_alternatives(self):
+        queryset = Target.objects.filter(
+            Q(index__lte=3) | Q(index__gte=2)).order_by('-index')
+        self.assertEqual(self.indexes(queryset), [5, 4, 3, 2, 1])
+        self.assertEqual(self.indexes(queryset[1:3]), [4, 3])
+        self.assertEqual(queryset.count(), 5)
+
+    def test_negated_conjunction(self):
+        self.assertEqual(
+            self.indexes(Target.objects.exclude(
+                index__gt=1, index__lt=5).order_by('index')),
+            [1, 5])
+
+    def test_delete(self):
+        Target.objects.filter(Q(index=2) | Q(index=3)).delete()
+        self.assertEqual(
+            self.indexes(Target.objects.all().order_by('index')),
+            [1, 4, 5])
+
+    def test_overridden_add_filters(self):
+        compiler = Target.objects.all().query.get_compiler(
+            connection=connection)
+        self.assertFalse(compiler._supports_or_filters())
+
+        class Query(compiler.query_class):
+            def add_filters(self, filters):
+                pass
+        compiler.query_class = Query
+        self.assertTrue(compiler._supports_or_filters())
+        connection.features.supports_or_filters = False
+        try:
+            self.assertFalse(compiler._supports_or_filters())
+        finally:
+            del connection.features.supports_or_filters
+
+
+class CompiledFiltersTest(TestCase):
+    entities = [{'index': index} for index in (None, 1, 2, 3, 4, 5)]
+
+    def indexes(self, queryset):
+        query = queryset.query.get_compiler(
+            connection=connection).build_query()
+        predicate = query._compile_filters(queryset.query.where)
+        return [entity['index'] for entity in self.entities
+                if predicate(entity)]
+
+    def test_negated(self):
+        self.assertEqual(
+            self.indexes(Target.objects.exclude(index__in=[1, 2])),
+            [None, 3, 4, 5])
+        self.assertEqual(
+            self.indexes(Target.objects.exclude(index__gt=1, index__lt=5)),
+            [None, 1, 5])
+
+    def test_nested(self):
+        self.assertEqual(
+            self.indexes(Target.objects.filter(
+                Q(index__gt=1) & ~(Q(index=3) | Q(index__gte=5)))),
+            [2, 4])
+        self.assertEqual(
+            self.indexes(Target.objects.filter(
+                Q(index=1) | (Q(index__gte=3) & ~Q(index=4)))),
+            [1, 3, 5])
+        self.assertEqual(self.indexes(Target.objects.all()),
+                         [None, 1, 2, 3, 4, 5])
+
+    def test_reuse(self):
+        queryset = Target.objects.filter(index__lt=3)
+        query = queryset.query.get_compiler(
+            connection=connection).build_query()
+        where = queryset.query.where
+        self.assertTrue(query._matches_filters({'index': 2}, where))
+        predicate = query._compiled_filters[1]
+        self.assertFalse(query._matches_filters({'index': 3}, where))
+        self.assertIs(query._compiled_filters[1], predicate)
+
+
+class InMemorySortTest(TestCase):
+
+    def setUp(self):
+        self.query = DateModel.objects.all().query.get_compiler(
+            connection=connection).build_query()
+        self.date = DateModel._meta.get_field('date')
+        self.datetime = DateModel._meta.get_field('datetime')
+        day = lambda day: day and datetime.date(2013, 1, day)
+        self.entities = [{'id': pk, 'date': day(date), 'datetime': day(time)}
+                         for pk, date, time in ((1, 2, 1), (2, None, 3),
+                                                (3, 2, None), (4, 1, 2),
+                                                (5, None, None), (6, 2, 3))]
+
+    def sort(self, ordering, low_mark=0, high_mark=None):
+        return [entity['id'] for entity in self.query._sort_in_memory(
+            list(self.entities), ordering, low_mark, high_mark)]
+
+    def test_nulls(self):
+        # Nulls go first in ascending and last in descending order.
+        self.assertEqual(self.sort([(self.date, True)]), [2, 5, 4, 1, 3, 6])
+        self.assertEqual(self.sort([(self.date, False)]), [1, 3, 6, 4, 2, 5])
+
+    def test_mixed_directions(self):
+        ordering = [(self.date, True), (self.datetime, False)]
+        self.assertEqual(self.sort(ordering), [2, 5, 4, 6, 1, 3])
+        self.assertEqual(self.sort(ordering, 1, 4), [5, 4, 6])
+        self.assertEqual(self.sort(ordering, 0, 2), [2, 5])
+        ordering = [(self.date, False), (self.datetime, True)]
+        self.assertEqual(self.sort(ordering, 2, None), [6, 4, 5, 2])
+
+    def test_cmp(self):
+        self.query._ordering_key = None
+        self.query.compiler._get_ordering = lambda: [(self.date, False)]
+        lhs, rhs = self.entities[1], self.entities[3]
+        self.assertEqual(self.query._order_in_memory(lhs, rhs), 1)
+        self.assertEqual(self.query._order_in_memory(rhs, lhs), -1)
+        self.assertEqual(self.query._order_in_memory(lhs, lhs), 0)
+
+
+class FilterOptimizationTest(TestCase):
+
+    def setUp(self):
+        connection.features.optimize_filters = True
+        self.query = Target.objects.all().query.get_compiler(
+            connection.alias).build_query()
+        self.field = Target._meta.get_field('index')
+
+    def tearDown(self):
+        del connection.features.optimize_filters
+
+    def optimize(self, *filters):
+        return [(lookup_type, value) for field, lookup_type, negated, value
+                in self.query._optimize_filters(
+                    [(self.field, lookup_type, negated, value)
+                     for lookup_type, negated, value in filters])]
+
+    def test_duplicates(self):
+        self.assertEqual(
+            self.optimize(('exact', False, 1), ('exact', False, 1)),
+            [('exact', 1)])
+
+    def test_ranges(self):
+        self.assertEqual(
+            self.optimize(('gte', False, 1), ('gt', False, 1),
+                          ('lt', False, 10), ('lte', False, 12)),
+            [('gt', 1), ('lt', 10)])
+        self.assertEqual(
+            self.optimize(('in', False, [1, 5, 20]), ('lt', False, 10)),
+            [('in', [1, 5])])
+        self.assertEqual(
+            self.optimize(('exact', False, 5), ('gte', False, 5)),
+            [('exact', 5)])
+
+    def test_in(self):
+        keys = list(range(1000)) * 2
+        filters = [(self.field, 'in', False, keys)]
+        self.assertIs(self.query._optimize_filters(filters)[0][3], keys)
+        self.assertEqual(
+            self.optimize(('in', False, [3, 1, 2, 1]),
+                          ('in', False, [2, 3, 4])),
+            [('in', [3, 2])])
+
+    def test_contradictions(self):
+        self.assertRaises(EmptyResultSet, self.optimize,
+                          ('exact', False, 1), ('exact', False, 2))
+        self.assertRaises(EmptyResultSet, self.optimize,
+                          ('in', False, [1, 2]), ('in', False, [3]))
+        self.assertRaises(EmptyResultSet, self.optimize,
+                          ('gt', False, 5), ('lte', False, 5))
+        self.assertEqual(
+            Target.objects.filter(index=1).filter(index=2).count(), 0)
+
+    def test_negated_filters(self):
+        self.assertEqual(
+            self.optimize(('exact', True, 1), ('exact', True, 2)),
+            [('exact', 1), ('exact', 2)])
+
+
+class BatchedInsertTest(TestCase):
+
+    def setUp(self):
+        features = connection.features
+        self.old_features = (features.max_insert_batch_size,
+                             features.pipeline_inserts)
+        features.max_insert_batch_size = 2
+
+    def tearDown(self):
+        (connection.features.max_insert_batch_size,
+         connection.features.pipeline_inserts) = self.old_features
+
+    def test_bulk_create(self):
+        Target.objects.bulk_create([Target(index=index)
+                                    for index in range(5)])
+        self.assertEqual(
+            [target.index for target in Target.objects.order_by('index')],
+            list(range(5)))
+
+    def test_pipelined_bulk_create(self):
+        connection.features.pipeline_inserts = True
+        Target.objects.bulk_create([Target(index=index)
+                                    for index in range(5)])
+        self.assertEqual(Target.objects.count(), 5)
+
+    def test_save(self):
+        target = Target.objects.create(index=1)
+        self.assertEqual(Target.objects.get(pk=target.pk).index, 1)
+
+
+class QueryPlanCacheTest(TestCase):
+
+    def setUp(self):
+        for index in range(3):
+            Target.objects.create(index=index)
+        connection.query_plans.clear()
+
+    def test_same_shape(self):
+        plans = connection.query_plans
+        self.assertEqual(Target.objects.get(index=1).index, 1)
+        self.assertEqual((plans.hits, plans.misses), (0, 1))
+        self.assertEqual(Target.objects.get(index=2).index, 2)
+        self.assertEqual((plans.hits, plans.misses), (1, 1))
+        self.assertEqual(
+            [target.index for target in
+             Target.objects.filter(index__gte=1).order_by('-index')],
+            [2, 1])
+        self.assertEqual((plans.hits, plans.misses), (1, 2))
+
+    def test_distinct_fields(self):
+        def plan_key(queryset):
+            return queryset.query.get_compiler(
+                connection.alias)._get_plan_key()[0]
+        queryset = Target.objects.filter(index=1)
+        queryset.query.distinct = True
+        distinct = queryset.all()
+        distinct.query.distinct_fields = ('index',)
+        self.assertNotEqual(plan_key(queryset), plan_key(distinct))
+
+    def test_eviction(self):
+        plans = QueryPlanCache(2)
+        plans.put('a', 1)
+        plans.put('b', 2)
+        plans.get('a')
+        plans.put('c', 3)
+        self.assertEqual(len(plans), 2)
+        self.assertEqual(plans.get('b'), None)
+        self.assertEqual((plans.get('a'), plans.get('c')), (1, 3))
+
+
+class QueryLogTest(TestCase):
+
+    def setUp(self):
+        for index in range(3):
+            Target.objects.create(index=index)
+        self.log = connection.query_log
+        self.old_settings = (self.log.sample_rate, self.log.records)
+        self.log.sample_rate = 1
+        self.log.records = deque(maxlen=2)
+
+    def tearDown(self):
+        self.log.sample_rate, self.log.records = self.old_settings
+
+    def test_records(self):
+        list(Target.objects.filter(index__gte=1)[:5])
+        Target.objects.count()
+        Target.objects.filter(index=7).count()
+        self.assertEqual(len(self.log), 2)
+        count, empty_count = self.log
+        self.assertEqual((count['model'], count['rows']), ('Target', 3))
+        self.assertEqual(empty_count['rows'], 0)
+        self.assertTrue(count['sql'].startswith('<'))
+        self.assertFalse(hasattr(count, 'query'))
+        self.assertTrue(count['fetch_time'] >= 0)
+
+    def test_fetch_record(self):
+        list(Target.objects.filter(index__gte=1)[:5])
+        record = list(self.log)[-1]
+        self.assertEqual((record['rows'], record['high_mark']), (2, 5))
+        self.assertTrue(record['decode_time'] >= 0)
+
+
+class InstrumentationTest(TestCase):
+
+    def setUp(self):
+        self.collector = connection.collector = HistogramCollector()
+
+    def tearDown(self):
+        connection.collector = None
+
+    def test_phases(self):
+        Target.objects.bulk_create([Target(index=index)
+                                    for index in range(3)])
+        list(Target.objects.filter(index__gte=1))
+        self.assertEqual(self.collector.summary()['decode']['rows'], 2)
+        Target.objects.filter(index=0).update(index=5)
+        Target.objects.filter(index=5).delete()
+        summary = self.collector.summary()
+        self.assertEqual(
+            set(summary),
+            set(['check', 'build', 'filters', 'fetch', 'decode', 'insert',
+                 'update', 'delete']))
+        self.assertEqual(summary['insert']['rows'], 3)
+        self.assertEqual(summary['update']['rows'], 1)
+        self.assertEqual(
+            sum(count for bound, count in summary['build']['histogram']),
+            summary['build']['count'])
+
+
+class AggregateTest(TestCase):
+
+    def setUp(self):
+        for index in (1, 2, 2, 7):
+            Target.objects.create(index=index)
+
+    def test_aggregates(self):
+        self.assertEqual(
+            Target.objects.aggregate(Sum('index'), Avg('index'),
+                                     Min('index'), Max('index')),
+            {'index__sum': 12, 'index__avg': 3.0, 'index__min': 1,
+             'index__max': 7})
+        self.assertEqual(
+            Target.objects.filter(index__lt=7).aggregate(
+                Sum('index'), count=Count('index', distinct=True)),
+            {'index__sum': 5, 'count': 2})
+
+    def test_no_results(self):
+        self.assertEqual(
+            Target.objects.filter(index__gt=7).aggregate(
+                Max('index'), Count('index')),
+            {'index__max': None, 'index__count': 0})
+
+    def test_count(self):
+        self.assertEqual(Target.objects.aggregate(Count('pk')),
+                         {'pk__count': 4})
+
+
+class DistinctTest(TestCase):
+
+    def setUp(self):
+        for index in (3, 1, 3, 2, 1, 3):
+            Target.objects.create(index=index)
+
+    def test_values(self):
+        queryset = Target.objects.values_list('index', flat=True)
+        self.assertEqual(list(queryset.order_by('index').distinct()),
+                         [1, 2, 3])
+        self.assertEqual(list(queryset.order_by('-index').distinct()[1:]),
+                         [2, 1])
+        self.assertEqual(queryset.distinct().count(), 3)
+        self.assertEqual(Target.objects.distinct().count(), 6)
+
+    def test_spill(self):
+        connection.features.distinct_memory_limit = 1
+        try:
+            self.assertEqual(
+                list(Target.objects.values_list('index', flat=True)
+                     .order_by('pk').distinct()),
+                [3, 1, 2])
+        finally:
+            del connection.features.distinct_memory_limit
+
+    def test_unique_rows(self):
+        rows = [[1, [2]], [2, []], [1, [2]], [3, []], [2, []], [4, []]]
+        for memory_limit in (None, 1, 2, 10):
+            self.assertEqual(list(unique_rows(rows, memory_limit)),
+                             [[1, [2]], [2, []], [3, []], [4, []]])
+
+
+class ResidualFilterTest(TestCase):
+
+    def setUp(self):
+        connection.features.pushdown_lookups = {
+            None: ('exact', 'in', 'lt', 'lte', 'gt', 'gte', 'isnull')}
+        for s in (u'Stra\xdfe', 'strasse', 'road', 'street', 'avenue'):
+            String.objects.create(s=s)
+
+    def tearDown(self):
+        del connection.features.pushdown_lookups
+
+    def values(self, queryset):
+        return list(queryset.order_by('pk').values_list('s', flat=True))
+
+    def test_lookups(self):
+        strings = String.objects.all()
+        self.assertEqual(self.values(strings.filter(s__icontains='STR')),
+                         [u'Stra\xdfe', 'strasse', 'street'])
+        self.assertEqual(self.values(strings.filter(s__endswith='e')),
+                         [u'Stra\xdfe', 'strasse', 'avenue'])
+        self.assertEqual(self.values(strings.filter(s__regex=r'^s.r')),
+                         ['strasse', 'street'])
+        self.assertEqual(
+            self.values(strings.filter(s__range=('r', 'st'))), ['road'])
+        self.assertEqual(
+            self.values(strings.filter(Q(s__contains='ee') |
+                                       Q(s__contains='oa'))),
+            ['road', 'street'])
+
+    def test_mixed(self):
+        strings = String.objects.filter(s__gt='r', s__iregex=r'e$')
+        self.assertEqual(self.values(strings), ['strasse'])
+        self.assertEqual(strings.count(), 1)
+
+    def test_slicing(self):
+        strings = String.objects.filter(s__contains='e')
+        self.assertEqual(list(strings.order_by('pk').values_list(
+            's', flat=True)[1:3]), ['strasse', 'street'])
+        self.assertEqual(strings[:2].count(), 2)
+
+    def test_delete(self):
+        String.objects.filter(s__startswith='str').delete()
+        self.assertEqual(self.values(String.objects.all()),
+                         [u'Stra\xdfe', 'road', 'avenue'])
+
+
+class DateModel(models.Model):
+    date = models.DateField(null=True)
+    datetime = models.DateTimeField(null=True)
+
+
+class DateLookupTest(TestCase):
+
+    def setUp(self):
+        for date in ((2012, 12, 31), (2013, 1, 1), (2013, 6, 15),
+                     (2014, 1, 1)):
+            DateModel.objects.create(date=datetime.date(*date),
+                                     datetime=datetime.datetime(*date))
+        DateModel.objects.create()
+
+    def dates(self, **filters):
+        return [date.strftime('%Y-%m-%d') for date in
+                DateModel.objects.filter(**filters).order_by('date')
+                .values_list('date', flat=True)]
+
+    def test_year(self):
+        self.assertEqual(self.dates(date__year=2013),
+                         ['2013-01-01', '2013-06-15'])
+        self.assertEqual(self.dates(datetime__year=2013),
+                         ['2013-01-01', '2013-06-15'])
+        self.assertEqual(self.dates(date__range=(datetime.date(2013, 1, 1),
+                                                 datetime.date(2014, 1, 1))),
+                         ['2013-01-01', '2013-06-15', '2014-01-01'])
+
+    def test_month_and_day(self):
+        self.assertEqual(self.dates(date__month=1),
+                         ['2013-01-01', '2014-01-01'])
+        self.assertEqual(self.dates(datetime__month=12), ['2012-12-31'])
+        self.assertEqual(self.dates(date__day=15), ['2013-06-15'])
+        self.assertEqual(self.dates(datetime__day=1, datetime__year=2014),
+                         ['2014-01-01'])
+
+
+@skipIf(numpy is None, "NumPy is not installed.")
+class VectorizedTest(TestCase):
+
+    def setUp(self):
+        connection.features.vectorize_threshold = 1
+        connection.features.pushdown_lookups = {None: ('exact',)}
+        for index in (3, 1, 4, 1, 5, 9, 2, 6):
+            Target.objects.create(index=index)
+
+    def tearDown(self):
+        del connection.features.vectorize_threshold
+        del connection.features.pushdown_lookups
+
+    def values(self, queryset):
+        return list(queryset.values_list('index', flat=True))
+
+    def test_sorting(self):
+        self.assertEqual(self.values(Target.objects.order_by('-index')),
+                         [9, 6, 5, 4, 3, 2, 1, 1])
+        self.assertEqual(
+            self.values(Target.objects.order_by('index', '-pk')[1:3]),
+            [1, 2])
+
+    def test_filtering(self):
+        self.assertEqual(
+            self.values(Target.objects.filter(
+                Q(index__gt=4) | Q(index__in=[1, 2])).exclude(index=9)
+                .order_by('index')),
+            [1, 1, 2, 5, 6])
+        self.assertEqual(Target.objects.filter(index__lt=4)[:2].count(), 2)
+
+    def test_unsupported(self):
+        large = 2 ** 53 + 1
+        for values, value in (([large, 1.5], 1), ([large], 1.5),
+                              ([1.5], large), ([u'a', b'b'], u'a')):
+            columns = Columns([{'c': item} for item in values])
+            self.assertRaises(Unsupported, leaf_mask, columns, 'c', 'gt',
+                              value)
+        Target.objects.create(index=2 ** 62 + 1)
+        self.assertEqual(Target.objects.filter(index__gt=2 ** 62).count(), 1)
+
+    def test_nulls(self):
+        entities = [{'index': index} for index in (3, None, 1, 5, None, 2)]
+        for queryset in (Target.objects.filter(index__lt=3),
+                         Target.objects.filter(index__lte=3),
+                         Target.objects.filter(index__gt=1),
+                         Target.objects.exclude(index__gte=3),
+                         Target.objects.filter(index__range=(1, 3)),
+                         Target.objects.exclude(index__in=[1, 5]),
+                         Target.objects.filter(index__isnull=True)):
+            where = queryset.query.where
+            query = queryset.query.get_compiler(
+                connection=connection).build_query()
+            predicate = query._compile_filters(where)
+            self.assertEqual(
+                select(entities, query._vectorize_filters(where)),
+                [entity for entity in entities if predicate(entity)])
+
+
+class BatchedDeleteTest(TestCase):
+
+    def setUp(self):
+        connection.features.max_delete_batch_size = 2
+        for index in range(5):
+            Target.objects.create(index=index)
+        self.progress = []
+        delete_progress.connect(self.record_progress, sender=Target)
+
+    def tearDown(self):
+        del connection.features.max_delete_batch_size
+        delete_progress.disconnect(self.record_progress, sender=Target)
+
+    def record_progress(self, sender, deleted, last_key, **kwargs):
+        self.progress.append(deleted)
+
+    def test_delete(self):
+        Target.objects.filter(index__gte=1).delete()
+        self.assertEqual(self.progress, [2, 4])
+        self.assertEqual(list(Target.objects.values_list('index', flat=True)),
+                         [0])
+
+    def test_resume(self):
+        keys = list(Target.objects.order_by('pk').values_list('pk', flat=True))
+        batches = delete_in_batches(Target.objects.all(), 2)
+        self.assertEqual(next(batches), (2, keys[1]))
+        batches.close()
+        self.assertEqual(Target.objects.count(), 3)
+        self.assertEqual(
+            list(delete_in_batches(Target.objects.all(), 2, keys[1])),
+            [(2, keys[3]), (3, keys[4])])
+        self.assertEqual(Target.objects.count(), 0)
+
+
+class UpdateOperatorTest(TestCase):
+
+    def check_updates(self):
+        target = Target.objects.create(index=1)
+        Target.objects.filter(pk=target.pk).update(index=F('index') + 2)
+        Target.objects.filter(pk=target.pk).update(index=F('index') - 5)
+        self.assertEqual(Target.objects.get(pk=target.pk).index, -2)
+
+        ListModel.objects.create(integer=1, floating_point=0,
+                                 names=['a', 'b', 'a'])
+        ListModel.objects.update(names=Push('c'), floating_point=1.5)
+        ListModel.objects.update(names=Pull('a'))
+        ListModel.objects.update(names=AddToSet('b'))
+        obj = ListModel.objects.get()
+        self.assertEqual(obj.names, ['b', 'c'])
+        self.assertEqual(obj.floating_point, 1.5)
+
+        SetModel.objects.create(setfield=set([1]))
+        SetModel.objects.update(setfield=AddToSet(2))
+        self.assertEqual(SetModel.objects.get().setfield, set([1, 2]))
+
+        DictModel.objects.create(dictfield={'a': 1})
+        DictModel.objects.update(dictfield=SetKey('b', 2))
+        self.assertEqual(DictModel.objects.get().dictfield,
+                         {'a': 1, 'b': 2})
+
+    def test_operators(self):
+        self.check_updates()
+
+    def test_emulated(self):
+        connection.features.supported_update_operators = ()
+        try:
+            self.check_updates()
+        finally:
+            del connection.features.supported_update_operators
+
+    def test_unsupported(self):
+        Target.objects.create(index=1)
+        self.assertRaises(DatabaseError, Target.objects.update,
+                          index=F('index') * 2)
+
+
+class PaginationTest(TestCase):
+
+    def setUp(self):
+        for index in (3, 1, 2, 1, 3, 1, 2):
+            Target.objects.create(index=index)
+
+    def pages(self, queryset, page_size):
+        pages = []
+        cursor = None
+        while True:
+            objects, cursor = paginate(queryset, page_size, cursor)
+            pages.append([obj.pk for obj in objects])
+            if cursor is None:
+                return pages
+
+    def test_ties(self):
+        for ordering in (('index',), ('-index',), ('-index', '-pk')):
+            queryset = Target.objects.order_by(*ordering)
+            keys = list(queryset.values_list('pk', flat=True))
+            pages = self.pages(queryset, 2)
+            self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+            self.assertEqual(sum(pages, []), keys)
+
+    def test_filtered(self):
+        queryset = Target.objects.filter(index__gte=2).order_by('index')
+        self.assertEqual(sum(self.pages(queryset, 3), []),
+                         list(queryset.values_list('pk', flat=True)))
+
+    def test_invalid_cursor(self):
+        objects, cursor = paginate(Target.objects.order_by('index'), 2)
+        self.assertRaises(InvalidCursor, paginate,
+                          Target.objects.order_by('-index'), 2, cursor)
+        self.assertRaises(InvalidCursor, paginate,
+                          Target.objects.order_by('index'), 2, cursor + 'x')
+
+
+@skipIf(asyncio is None or sys.version_info < (3, 5, 2),
+        "The asynchronous interface requires Python 3.5.2.")
+class AsyncTest(TestCase):
+
+    def setUp(self):
+        # Not set as the current event loop, the awaitables should use
+        # the running one.
+        self.loop = asyncio.new_event_loop()
+        for index in range(5):
+            Target.objects.create(index=index)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def compiler(self, queryset):
+        return queryset.query.get_compiler(connection=connection)
+
+    def test_results(self):
+        compiler = self.compiler(
+            Target.objects.filter(index__gte=2).values_list('index'))
+        iterator = compiler.aresults_iter()
+        rows = []
+        while True:
+            try:
+                rows.append(self.loop.run_until_complete(iterator.__anext__()))
+            except StopAsyncIteration:
+                break
+        self.assertEqual(sorted(row[0] for row in rows), [2, 3, 4])
+
+    def test_count_and_delete(self):
+        query = self.compiler(Target.objects.filter(index__lt=3)).build_query()
+        self.assertEqual(self.loop.run_until_complete(query.acount()), 3)
+        self.loop.run_until_complete(query.adelete())
+        self.assertEqual(Target.objects.count(), 2)
+
+
+class AsyncIteratorTest(TestCase):
+    """
+    Checks the parts of the asynchronous interface that run without an
+    event loop (and on Python 2).
+    """
+
+    def test_chunks(self):
+        calls = []
+
+        def results():
+            calls.append(True)
+            return iter(range(5))
+        iterator = AsyncIterator(results, connection, chunk_size=2)
+        self.assertEqual(iterator._next_chunk(), [0, 1])
+        self.assertEqual(iterator._refill([0, 1]), 0)
+        self.assertFalse(iterator.exhausted)
+        self.assertEqual(iterator._next_chunk(), [2, 3])
+        self.assertEqual(iterator._next_chunk(), [4])
+        self.assertEqual(iterator._refill([4]), 1)
+        self.assertTrue(iterator.exhausted)
+        self.assertEqual(list(iterator.buffer), [4])
+        self.assertEqual(len(calls), 1)
+
+    def test_shutdown(self):
+        shutdowns = []
+
+        class Executor(object):
+            def shutdown(self, wait):
+                shutdowns.append(wait)
+        connection.async_executor = Executor()
+        shutdown_executor(connection)
+        shutdown_executor(connection)
+        self.assertEqual(shutdowns, [False])
+        self.assertIsNone(connection.async_executor)
+
+
+class ConversionCacheTest(TestCase):
+
+    def test_cache(self):
+        ops = connection.ops
+        ops.warm_conversions([ListModel])
+        field = ListModel._meta.get_field('names')
+        conversions = len(ops._conversions)
+        self.assertEqual(ops._convert_as(field), ops._convert_as(field))
+        self.assertEqual(ops._convert_as(field.item_field)[1], 'CharField')
+        self.assertEqual(len(ops._conversions), conversions)
+
+        class_prepared.send(sender=Target)
+        ops._convert_as(field)
+        self.assertEqual(len(ops._conversions), 1)
+
+
+class DecodeTest(TestCase):
+
+    def setUp(self):
+        Target.objects.create(index=1)
+
+    def test_overridden_make_result(self):
+        base = type(Target.objects.all().query.get_compiler(
+            connection=connection))
+
+        class Compiler(base):
+            def _make_result(self, entity, fields):
+                values = super(Compiler, self)._make_result(entity, fields)
+                return [value * 10 for value in values]
+        query = Target.objects.values_list('index').query
+        compiler = Compiler(query, connection, connection.alias)
+        self.assertEqual(list(compiler.results_iter()), [[10]])
+
+    def test_converted_fields(self):
+        fields = DictModel._meta.fields
+        compiler = DictModel.objects.all().query.get_compiler(
+            connection=connection)
+        entity = {'id': 1, 'dictfield': {'a': 1}, 'dictfield_nullable': None}
+        values = compiler._make_result(entity, fields)
+        self.assertEqual(values[:3], [1, {'a': 1}, None])
+        self.assertIsNot(values[1], entity['dictfield'])
+        # Missing columns get the field's default.
+        self.assertEqual(values[3], {})
+        self.assertRaises(IntegrityError, compiler._make_result,
+                          dict(entity, dictfield=None), fields)
+
+    def test_convert_values(self):
+        base = type(connection.ops)
+
+        class Operations(base):
+            def convert_values(self, value, field):
+                if field.name == 'index':
+                    return value + 1
+                return value
+        ops = connection.ops
+        connection.ops = Operations(connection)
+        class_prepared.send(sender=Target)
+        try:
+            self.assertEqual(list(Target.objects.values_list(
+                'index', flat=True)), [2])
+        finally:
+            connection.ops = ops
+            class_prepared.send(sender=Target)
+
+    def test_single_implementation(self):
+        compiler = Target.objects.all().query.get_compiler(
+            connection=connection)
+        fields = [Target._meta.get_field('index')]
+        self.assertIs(compiler._get_decoder(fields),
+                      get_decoder(connection, fields))
+        self.assertEqual(compiler._make_result({'index': 3}, fields), [3])
+
+
+class CodegenTest(TestCase):
+
+    def test_codecs(self):
+        fields = ListModel._meta.fields
+        obj = ListModel(integer=1, floating_point=2.5, names=['a'])
+        encode = get_encoder(connection, fields)
+        self.assertIs(get_encoder(connection, fields), encode)
+        entity = encode(obj, True)
+        self.assertEqual(entity['names'], ['a'])
+        # Plain numbers need no conversion.
+        self.assertNotIn('convert0', encode.source)
+
+        del entity['names_with_default']
+        values = get_decoder(connection, fields)(entity)
+        self.assertEqual(values[:3], [1, 2.5, ['a']])
+        self.assertEqual(values[3], [])
+        self.assertRaises(IntegrityError, get_decoder(connection, fields),
+                          dict(entity, floating_point=None))
+
+    def test_collections(self):
+        fields = NestedListModel._meta.fields
+        encode = get_encoder(connection, fields)
+        decode = get_decoder(connection, fields)
+        # Items get converted by the generated code.
+        self.assertIn('for item0 in value', encode.source)
+        self.assertIn('for item0 in value', decode.source)
+        obj = NestedListModel(id=1, lists=[[1, 2], [3]],
+                              embedded=[SetModel(setfield=set([4]))])
+        entity = encode(obj, True)
+        self.assertEqual(entity['lists'], [[1, 2], [3]])
+        self.assertIsNot(entity['lists'][0], obj.lists[0])
+        values = decode(entity)
+        self.assertEqual(values[1], [[1, 2], [3]])
+        self.assertEqual(values[2], connection.ops.value_from_db(
+            entity['embedded'], fields[2]))
+
+        obj = NestedListModel.objects.create(lists=[[5]], embedded=[])
+        self.assertEqual(NestedListModel.objects.get(pk=obj.pk).lists, [[5]])
+
+    def test_invalidation(self):
+        fields = ListModel._meta.fields
+        encode = get_encoder(connection, fields)
+        class_prepared.send(sender=Target)
+        self.assertIsNot(get_encoder(connection, fields), encode)
+
+
+class SerializerTest(TestCase):
+
+    def test_round_trip(self):
+        field = ListModel._meta.get_field('names')
+        ops = connection.ops
+        try:
+            for name in (None, 'marshal', 'json', 'pickle'):
+                field.serializer = name
+                for db_type in ('bytes', 'string'):
+                    data = ops._value_for_db(['a', 'b'], field, 'ListField',
+                                             db_type, None)
+                    self.assertEqual(ops._value_from_db(
+                        data, field, 'ListField', db_type), ['a', 'b'])
+            self.assertTrue(data.startswith(b'\x03'))
+        finally:
+            field.serializer = None
+
+    def test_compression(self):
+        field = ListModel._meta.get_field('names')
+        ops = connection.ops
+        options = connection.settings_dict.setdefault('OPTIONS', {})
+        options.update(COMPRESSION='zlib', COMPRESSION_THRESHOLD=100)
+        collector = connection.collector = HistogramCollector()
+        try:
+            for names in (['a'], ['a'] * 100):
+                data = ops._value_for_db(names, field, 'ListField', 'bytes',
+                                         None)
+                self.assertEqual(data.startswith(b'\x10'), len(names) > 1)
+                self.assertEqual(ops._value_from_db(
+                    data, field, 'ListField', 'bytes'), names)
+        finally:
+            del options['COMPRESSION'], options['COMPRESSION_THRESHOLD']
+            connection.collector = None
+        summary = collector.summary()
+        self.assertEqual(summary['compress']['count'], 1)
+        counters = summary['decompress']['counters']
+        self.assertTrue(counters['compressed_size'] < counters['size'])
+
+    def test_legacy(self):
+        for protocol in (0, 2):
+            self.assertEqual(deserialize(pickle.dumps(set([1]), protocol)),
+                             set([1]))
+        self.assertEqual(deserialize(serialize(set([1]), 'json')), [1])
+
+
+class CollectionConversionTest(TestCase):
+
+    def test_pass_through(self):
+        ops = connection.ops
+        field = ListModel._meta.get_field('names')
+        names = [u'a', u'b']
+        self.assertIs(ops._value_for_db(names, field, 'ListField', 'list',
+                                        None), names)
+        loaded = ops._value_from_db(names, field, 'ListField', 'list')
+        self.assertEqual(loaded, names)
+        self.assertIsNot(loaded, names)
+
+        field = SetModel._meta.get_field('setfield')
+        self.assertEqual(ops._value_for_db([1, 2], field, 'SetField', 'set',
+                                           None), set([1, 2]))
+
+    def test_wrapped_strings(self):
+        from django.utils.safestring import mark_safe
+        ops = connection.ops
+        self.assertTrue(ops._items_pass_through(
+            [u'a', 'b'], 'ListField', 'CharField', 'list'))
+        # Marked strings still go through per-item conversions.
+        self.assertFalse(ops._items_pass_through(
+            [u'a', mark_safe(u'b')], 'ListField', 'CharField', 'list'))
+        self.assertFalse(ops._items_pass_through(
+            {'a': 1}, 'DictField', 'IntegerField', 'list'))
+
 
 class DecimalFieldTest(TestCase):
     """
@@ -830,3 +1805,28 @@ class QuerysetTest(TestCase):
 
     def test_none(self):
         self.assertEqual(0, len(QuerysetModel.objects.none()))
+
+
+class SortedIndexTest(TestCase):
+
+    def setUp(self):
+        self.index = SortedIndex('value')
+        for pk, value in enumerate([5, None, 3, 5, 8, 1]):
+            self.index.add(value, pk)
+
+    def test_exact(self):
+        self.assertEqual(self.index.exact(5), [0, 3])
+        self.assertEqual(self.index.exact(None), [1])
+        self.assertEqual(self.index.exact(4), [])
+
+    def test_range(self):
+        self.assertEqual(self.index.range(3, True, 5, False), [2])
+        self.assertEqual(self.index.range(3, False, 8, True), [0, 3, 4])
+        self.assertEqual(self.index.range(upper=3), [5, 2])
+        self.assertEqual(self.index.range(lower=5), [0, 3, 4])
+
+    def test_remove(self):
+        self.index.remove(5, 0)
+        self.index.remove(None, 1)
+        self.assertEqual(self.index.exact(5), [3])
+        self.assertEqual(self.index.range(), [5, 2, 3, 4])